@@ -1,15 +1,18 @@
 import re
 import os
-import yaml
-import pytholog as pl
+import time
+import pickle
+import hashlib
+import itertools
+import threading
+from collections import Counter, deque
 from enum import Enum, auto
 from dataclasses import dataclass
 from dataclasses import asdict
-import customtkinter as ctk
-from tkinter import scrolledtext
-import time
-import threading
-import tkinter as tk
+from dataclasses import replace
+from knowledge import KnowledgeBase, Overlay, compile_clauses
+from journal import Journal
+from metrics import Metrics
 
 class SentenceType(Enum):
     Statement =  auto()
@@ -21,144 +24,508 @@ class SentenceType(Enum):
     WhoQuestion = auto()
 
 
+# distinct strings Lux.think_many remembers before it starts over
+MEMO_SIZE = 65536
+
+# bump when the layout of the compiled data.yaml cache changes
+DATA_FORMAT = 1
+
+# Answers Translator.translate reads, by sentence type; resolution stops once
+# it has them. A yes/no question only needs one proof. When and Where print
+# the first answer found, which need not be the first in sorted order, and a
+# second one still tells an answer like "no" from a negative reply. The
+# other questions list every answer, sorted.
+ANSWER_LIMITS = {
+    SentenceType.Question: 1,
+    SentenceType.WhenQuestion: 2,
+    SentenceType.WhereQuestion: 2,
+}
+
+# replies to a question resolution gave up on (see KnowledgeBase.last_complete):
+# without an answer, and after the answers found until then
+TOO_BROAD = "That question is too broad, I could not answer it in time."
+PARTIAL = "There may be more, the question is too broad to find them all."
+
+
+# data.yaml parsed, with its rules compiled, cached in __pycache__ under the
+# content hash of the file: an unchanged file is never parsed twice and yaml
+# and pytholog are not even imported
+def load_data(datafile : str):
+    with open(datafile, 'rb') as file:
+        content = file.read()
+    digest = hashlib.sha256(content).hexdigest()
+    directory, name = os.path.split(os.path.abspath(datafile))
+    cachefile = os.path.join(directory, '__pycache__', name + '.lux.pickle')
+    try:
+        with open(cachefile, 'rb') as file:
+            data = pickle.load(file)
+        if data.get('format') == DATA_FORMAT and data.get('hash') == digest:
+            return data
+    except Exception:
+        pass
+
+    import yaml
+    # libyaml when it is there: the parse also runs next to queries on a reload
+    parsed = yaml.load(content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    data = {
+        'format': DATA_FORMAT,
+        'hash': digest,
+        'synonyms': parsed['synonyms'],
+        'concats': parsed['concats'],
+        'rules': parsed['rules'],
+        'compiled': compile_clauses(parsed['rules']),
+    }
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        with open(cachefile + '.tmp', 'wb') as file:
+            pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cachefile + '.tmp', cachefile)
+    except OSError:
+        pass
+    return data
+
+
+@dataclass
+class DataChange():
+
+    base : dict                                 # load_data() result the change was diffed from
+    data : dict                                 # and the one it leads to
+    lexer : 'Lexer'                             # None when synonyms and concats are unchanged
+    removed_rules : list
+    added_rules : list
+    removed_facts : list[tuple[str, tuple]]
+    added_facts : list[tuple[str, tuple]]
+
+
+# what changed between two load_data() results, clauses compared by their
+# compiled form, so reformatting a rule changes nothing
+def diff_data(old : dict, new : dict):
+    (old_facts, old_rules), (new_facts, new_rules) = old['compiled'], new['compiled']
+
+    def changed(rules, others):
+        key = lambda rule: (rule.predicate, rule.args, tuple(rule.body))
+        extra = Counter(map(key, rules)) - Counter(map(key, others))
+        result = []
+        for rule in rules:
+            if extra[key(rule)]:
+                extra[key(rule)] -= 1
+                result.append(rule)
+        return result
+
+    def missing(facts, others):
+        others = {predicate: set(rows) for predicate, rows in others.items()}
+        return [(predicate, row) for predicate, rows in facts.items() for row in rows if row not in others.get(predicate, ())]
+
+    lexer = None
+    if old['synonyms'] != new['synonyms'] or old['concats'] != new['concats']:
+        lexer = Lexer(new['synonyms'], new['concats'])
+    return DataChange(old, new, lexer, changed(old_rules, new_rules), changed(new_rules, old_rules),
+                      missing(old_facts, new_facts), missing(new_facts, old_facts))
+
+
 class Lux():
-    def __init__(self, datafile : str):
-        with open(datafile, 'r') as file:
-             self.data = yaml.safe_load(file)
+    # state_dir keeps learned facts across restarts (see journal.Journal);
+    # with metrics every think is traced into it (see metrics.Metrics)
+    def __init__(self, datafile : str, materialized : bool = False, state_dir : str = None,
+                 metrics : Metrics = None):
+        self.metrics = metrics
+        self.datafile = datafile
+        self.data = load_data(datafile)
         self.lexer = Lexer(self.data['synonyms'], self.data['concats'])
         self.parser = Parser()
-        self.processor = Processor(self.data['rules'])
+        journal = Journal(state_dir) if state_dir else None
+        self.processor = Processor(self.data['rules'], materialized=materialized, journal=journal,
+                                   compiled=self.data['compiled'])
         self.translator = Translator()
+        # a reload waiting for the next think (see schedule_reload)
+        self.pending = None
+        self._pending_lock = threading.Lock()
+
+    def close(self):
+        self.processor.close()
+
+    # Hot reload of data.yaml (see watcher.DataWatcher). prepare_reload reads
+    # and diffs the file, which may take a while, on any thread; the change is
+    # applied by the thread that calls think, before the next query starts, so
+    # every query sees either the old or the new data as a whole. Learned facts
+    # are kept, only the clauses, synonyms and concats that changed are
+    # patched. reload() prepares and applies at once.
+    def prepare_reload(self, datafile : str = None):
+        base = self.data
+        data = load_data(self.datafile if datafile is None else datafile)
+        if data['hash'] == base['hash']:
+            return None
+        return diff_data(base, data)
+
+    def schedule_reload(self, change : DataChange):
+        with self._pending_lock:
+            self.pending = change
+
+    def reload(self, datafile : str = None):
+        change = self.prepare_reload(datafile)
+        if change is not None:
+            self.apply(change)
+        return change
+
+    def apply(self, change : DataChange):
+        if change.base is not self.data:
+            # diffed before another change was applied
+            change = diff_data(self.data, change.data)
+        if change.lexer is not None:
+            self.lexer = change.lexer
+        self.processor.update(change)
+        self.data = change.data
+        if self.metrics is not None:
+            self.metrics.count('reloads')
+
+    # applies the scheduled reload, if any, and returns it
+    def _apply_pending(self):
+        with self._pending_lock:
+            change, self.pending = self.pending, None
+        if change is not None:
+            self.apply(change)
+        return change
 
     
-    def think(self, query):
+    # kb is the knowledge base to learn into and answer from, the
+    # processor's own by default (see overlay())
+    def think(self, query, kb : KnowledgeBase = None):
+        if self.pending is not None:
+            self._apply_pending()
+        metrics = self.metrics
+        if metrics is None:
+            return self._think(self.lexer.preprocess(query), kb)
+        start = time.perf_counter()
         preprocessed = self.lexer.preprocess(query)
+        metrics.time('preprocess', time.perf_counter() - start)
+        reply = self._think(preprocessed, kb)
+        metrics.time('think', time.perf_counter() - start)
+        metrics.count('queries')
+        return reply
+
+    # with self.metrics, _think and _reply record the time of every stage,
+    # the parser form, the resolution steps and the cache outcome
+    def _think(self, preprocessed : str, kb : KnowledgeBase = None):
+        metrics = self.metrics
         if preprocessed == "hi" or preprocessed == "hello":
+            if metrics is not None:
+                metrics.count('greetings')
             return "Hello! How can I help you?"
-        sentence = lux.parser.parse(preprocessed)
+        if metrics is not None:
+            start = time.perf_counter()
+        sentence = self.parser.parse(preprocessed)
         # print (sentence)
-        reply = lux.processor.process_query(sentence)
+        if metrics is not None:
+            metrics.time('parse', time.perf_counter() - start)
+            form = self.parser.form
+            metrics.forms[f'{form[0]}/{form[1]}' if form else 'none'] += 1
+            metrics.count(f'sentences.{sentence.stype.name}')
+        return self._reply(preprocessed, sentence, kb)
+
+    # a knowledge base of its own for one conversation, sharing the rules and
+    # facts of this Lux (see sessions.SessionStore)
+    def overlay(self, cache_size : int = 64):
+        return Overlay(self.processor.engine, cache_size)
+
+    def _reply(self, preprocessed : str, sentence : 'Sentence', kb : KnowledgeBase = None):
+        metrics = self.metrics
+        engine = self.processor.engine if kb is None else kb
+        engine.last_complete = True
+        if metrics is not None:
+            engine.last_steps = None
+            start = time.perf_counter()
+        reply = self.processor.process_query(sentence, kb)
+        if metrics is not None:
+            processed = time.perf_counter()
+            metrics.time('process_query', processed - start)
+            if engine.last_steps is not None:
+                if engine.last_steps:
+                    metrics.count('cache.misses')
+                    metrics.observe('resolution_steps', engine.last_steps)
+                else:
+                    metrics.count('cache.hits')
         translated = ''
         if "hello" in preprocessed:
             translated = "Hello! "
-        translated += lux.translator.translate(sentence, reply)
+        translated += self.translator.translate(sentence, reply, engine.last_complete)
+        if metrics is not None:
+            metrics.time('translate', time.perf_counter() - processed)
+            metrics.gauge('kb.clauses', len(self.processor.engine))
         return translated
+
+    # Generator of replies to an iterable of queries, in input order. Every
+    # distinct string is lexed and parsed once; a question repeated before the
+    # next statement is answered once, since only a statement changes answers.
+    # A reload scheduled meanwhile is applied before the next query.
+    def think_many(self, queries):
+        preprocessed_of = {}
+        sentences = {}
+        replies = {}
+        for query in queries:
+            if self.pending is not None and self._apply_pending() is not None:
+                preprocessed_of.clear()
+                sentences.clear()
+                replies.clear()
+            preprocessed = preprocessed_of.get(query)
+            if preprocessed is None:
+                if len(preprocessed_of) >= MEMO_SIZE:
+                    preprocessed_of.clear()
+                preprocessed = preprocessed_of[query] = self.lexer.preprocess(query)
+            if preprocessed == "hi" or preprocessed == "hello":
+                yield "Hello! How can I help you?"
+                continue
+
+            reply = replies.get(preprocessed)
+            if reply is None:
+                sentence = sentences.get(preprocessed)
+                if sentence is None:
+                    if len(sentences) >= MEMO_SIZE:
+                        sentences.clear()
+                    sentence = sentences[preprocessed] = self.parser.parse(preprocessed)
+                # the processor fills in the question variables, so it gets a copy
+                reply = self._reply(preprocessed, replace(sentence))
+                if sentence.stype == SentenceType.Statement:
+                    replies.clear()
+                else:
+                    replies[preprocessed] = reply
+            yield reply
         
 
+ARTICLES = ("a", "an", "the")
+
+
+def pluralize(word : str):
+    return word + 'es' if word.endswith(('s','x','z','ch','sh','ss')) else word + 's'
+
+
+class PhraseJoiner():
+
+    # Aho-Corasick automaton over tokens: one pass over the query finds every
+    # multiword phrase, and the leftmost-longest ones are joined with _
+    def __init__(self, phrases : list[str]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.lengths = [()]  # lengths of the phrases that end in each state
+        for phrase in phrases:
+            words = phrase.split()
+            if len(words) < 2:
+                continue
+            state = 0
+            for word in words:
+                following = self.goto[state].get(word)
+                if following is None:
+                    following = self.goto[state][word] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.lengths.append(())
+                state = following
+            self.lengths[state] = (len(words),)
+
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for word, following in self.goto[state].items():
+                pending.append(following)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = self.goto[fallback].get(word, 0)
+                self.lengths[following] += self.lengths[self.fail[following]]
+
+    def join(self, tokens : list[str]):
+        goto, fail, lengths = self.goto, self.fail, self.lengths
+        matches = []
+        state = 0
+        for end, token in enumerate(tokens, 1):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for length in lengths[state]:
+                matches.append((end - length, -length))
+        if not matches:
+            return tokens
+
+        joined = []
+        position = 0
+        for start, length in sorted(matches):
+            if start < position:
+                continue
+            joined.extend(tokens[position:start])
+            position = start - length
+            joined.append('_'.join(tokens[start:position]))
+        joined.extend(tokens[position:])
+        return joined
+
+
 class Lexer():
 
     def __init__(self, synonyms : dict[str, str], concats : list[str]):
         self.synonyms = synonyms
         self.concats = concats
+        self.surface = self._surface_forms(synonyms)
+        self.phrases = PhraseJoiner(concats)
+
+    # Every surface form a token can take, mapped to the tokens it becomes:
+    # plurals of synonyms ("classes" -> "subjects"), articles (dropped) and the
+    # synonyms themselves, filled in reverse order of precedence.
+    def _surface_forms(self, synonyms : dict[str, str]):
+        surface = {}
+        for suffix in ('s', 'es'):
+            for word, synonym in synonyms.items():
+                if isinstance(word, str) and word + suffix != 'is':
+                    surface[word + suffix] = tuple(pluralize(synonym).split())
+        for article in ARTICLES:  # Пропускаємо артиклі
+            surface[article] = ()
+        for word, synonym in synonyms.items():
+            surface[word] = tuple(synonym.split())
+        return surface
 
     def preprocess(self, query : str):
         query = query.replace('?',' ?').replace('!','')
-        query_arr = query.lower().split()
-
-        pluralize = lambda word : word + 'es' if word.endswith(('s','x','z','ch','sh','ss')) else word + 's'
 
+        surface = self.surface
         processed_arr = []
-        for token in query_arr:
-             if token in self.synonyms:
-                 processed_arr.append(self.synonyms[token])
-             elif token in {"a", "an", "the"}:  # Пропускаємо артиклі
-                 continue
-             elif token.endswith('es') and token[:-2] in self.synonyms:
-                 processed_arr.append(pluralize(self.synonyms[token[:-2]]))
-             elif token.endswith('s') and token[:-1] in self.synonyms and token != 'is':
-                 processed_arr.append(pluralize(self.synonyms[token[:-1]]))
-             else:
-                 processed_arr.append(token)
-        processed = ' '.join(processed_arr)
-
-        for phrase in self.concats:
-            if phrase in processed:
-                processed = processed.replace(phrase, phrase.replace(' ','_'))
-        
-        return processed
+        for token in query.lower().split():
+            form = surface.get(token)
+            if form is None:
+                processed_arr.append(token)
+            else:
+                processed_arr.extend(form)
+
+        return ' '.join(self.phrases.join(processed_arr))
+
+# Grammar of Parser.parse. Every form is a row of slots: 'question' is the
+# leading keyword, 'of' is the literal word, 'addition_prefix' is in|at and any
+# other slot captures one word. Forms are tried in order and each one is matched
+# at the rightmost position of the query where it fits.
+QUESTION_FORMS = (
+    (('which',), (
+        ('question', 'subject', 'rule_name', 'value', 'addition_prefix', 'addition'), #matches "Which Dog eat apples at night?"
+        ('question', 'subject', 'rule_name', 'addition_prefix', 'addition'), #matches "Which Dog eat at night?"
+        ('question', 'subject', 'rule_name', 'value'), #matches "Which Dog eat apples?"
+        ('question', 'subject', 'rule_name'), #matches "Which Dog eat?"
+    )),
+    (('who',), (
+        ('question', 'rule_name', 'addition_prefix', 'addition'), #matches "Who eat at night?"
+        ('question', 'rule_name', 'value', 'addition_prefix', 'addition'), #matches "Who eat apples at night?"
+        ('question', 'rule_name', 'value'), #matches "Who eat apples?"
+        ('question', 'rule_name'), #matches "Who eat?"
+    )),
+    (('what',), (
+        ('question', 'subject', 'of', 'belong', 'rule_name', 'addition_prefix', 'addition'), #matches "What Dog of user eat at night?"
+        ('question', 'subject', 'of', 'belong', 'rule_name'), #matches "What dog of user eat?"
+        ('question', 'subject', 'rule_name', 'addition_prefix', 'addition'), #matches "What Dog eat at night?"
+        ('question', 'subject', 'rule_name'), #matches "What Dog eat?"
+    )),
+    (('when', 'where'), (
+        ('question', 'subject', 'of', 'belong', 'rule_name', 'value'), #matches "When Dog of user eat apples?"
+        ('question', 'subject', 'of', 'belong', 'rule_name'), #matches "When dog of user eat?"
+        ('question', 'subject', 'rule_name', 'value'), #matches "When Dog eat the apples?"
+        ('question', 'subject', 'rule_name'), #matches "When Dog eat?"
+    )),
+)
+
+# Statements may end with "?" which turns them into a yes/no question
+STATEMENT_FORMS = (
+    ('subject', 'of', 'belong', 'rule_name', 'value', 'addition_prefix', 'addition'), #matches "dog of user eat apples at night" or "dog of user eat apples at night?"
+    ('subject', 'of', 'belong', 'rule_name', 'addition_prefix', 'addition'), #matches "Dog of user eat at night" or "Dog of user eat at night?"
+    ('subject', 'rule_name', 'value', 'addition_prefix', 'addition'), #matches "dog eat apples at night" or "dog eat apples at night?"
+    ('subject', 'rule_name', 'addition_prefix', 'addition'), #matches "Dog eat at night" or "Dog eat at night?"
+    ('subject', 'of', 'belong', 'rule_name', 'value'), #matches "Dog of user eat apples" or "Dog of user eat apples?"
+    ('subject', 'of', 'belong', 'rule_name'), #matches "Dog of user eat" or "Dog of user eat?"
+    ('subject', 'rule_name', 'value'), #matches "Dog eat apples" or "Dog eat apples?"
+    ('subject', 'rule_name'), #matches "Dog eat" or "Dog eat?"
+)
+
+QUESTION_WORDS = frozenset(word for words, _ in QUESTION_FORMS for word in words)
+
+WORD = re.compile(r'[a-zA-Z0-9_]*')
 
 class Parser():
-    
+
+    form = None
+
+    # The query is tokenized once (the lexer joins tokens with single spaces).
+    # For every token we keep the length of its leading [a-zA-Z0-9_] run: a
+    # slot in the middle of a form needs the whole token to be a word, the last
+    # slot of a form only needs a non-empty word prefix.
+    def _tokenize(self, query : str):
+        tokens = query.split(' ')
+        words = []
+        keywords = {}
+        for i, token in enumerate(tokens):
+            words.append(WORD.match(token).end())
+            if token in QUESTION_WORDS:
+                keywords.setdefault(token, []).append(i)
+        return tokens, words, keywords
+
+    def _match_form(self, form : tuple, tokens : list[str], words : list[int], start : int):
+        last = start + len(form) - 1
+        if last >= len(tokens) or words[last] == 0:
+            return None
+        fields = {}
+        for i in range(start, last):
+            slot, token = form[i - start], tokens[i]
+            if slot == 'of':
+                if token != 'of':
+                    return None
+                continue
+            if slot == 'addition_prefix':
+                if token != 'in' and token != 'at':
+                    return None
+            elif slot != 'question' and (words[i] == 0 or words[i] != len(token)):
+                return None
+            fields[slot] = token
+        fields[form[-1]] = tokens[last][:words[last]]
+        return fields
+
+    def _match_question(self, tokens : list[str], words : list[int], keywords : dict[str, list[int]]):
+        for question_words, forms in QUESTION_FORMS:
+            starts = sorted((i for word in question_words for i in keywords.get(word, ())), reverse=True)
+            if not starts:
+                continue
+            for number, form in enumerate(forms):
+                for start in starts:
+                    if fields := self._match_form(form, tokens, words, start):
+                        self.form = (fields['question'], number)
+                        return fields
+        return None
+
+    def _match_statement(self, tokens : list[str], words : list[int]):
+        for number, form in enumerate(STATEMENT_FORMS):
+            for start in range(len(tokens) - 1, -1, -1):
+                if fields := self._match_form(form, tokens, words, start):
+                    self.form = ('statement', number)
+                    # trailing "?" either right after the last word or as the next token
+                    last = start + len(form) - 1
+                    token, word = tokens[last], words[last]
+                    if word < len(token):
+                        fields['question'] = '?' if token[word] == '?' else None
+                    elif last + 1 < len(tokens) and tokens[last + 1].startswith('?'):
+                        fields['question'] = '?'
+                    return fields
+        return None
+
+    # form is (question word or 'statement', row in its form table) of the
+    # last parse, None when no form matched
     def parse(self, query : str):
         sen_type = SentenceType.Statement
-        question = subject = belong = rule_name = value = addition_prefix = addition = None
-
-        #matches "Which Dog eat apples at night?"
-        if match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name, value, addition_prefix, addition = match.groups()
-        #matches "Which Dog eat at night?"
-        elif match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name, addition_prefix, addition = match.groups()
-        #matches "Which Dog eat apples?"
-        elif match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name, value = match.groups()
-        #matches "Which Dog eat?"
-        elif match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name = match.groups()
-
-        #matches "Who eat at night?"
-        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
-            question, rule_name, addition_prefix, addition = match.groups()
-        #matches "Who eat apples at night?"
-        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
-            question, rule_name, value, addition_prefix, addition = match.groups()
-        #matches "Who eat apples?"
-        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, rule_name, value = match.groups()
-        #matches "Who eat?"
-        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+)', query):
-            question, rule_name = match.groups()
-
-        #matches "What Dog of user eat at night?"
-        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
-            question, subject, belong, rule_name, addition_prefix, addition = match.groups()
-        #matches "What dog of user eat?"
-        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, belong, rule_name = match.groups()
-        #matches "What Dog eat at night?"
-        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name, addition_prefix, addition = match.groups()
-        #matches "What Dog eat?"
-        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name = match.groups()
-
-        #matches "When Dog of user eat apples?"
-        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, belong, rule_name, value = match.groups()
-        #matches "When dog of user eat?"
-        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, belong, rule_name = match.groups()
-        #matches "When Dog eat the apples?"
-        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name, value = match.groups()
-        #matches "When Dog eat?"
-        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
-            question, subject, rule_name = match.groups()
-
-        #matches "dog of user eat apples at night" or "dog of user eat apples at night?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, belong, rule_name, value, addition_prefix, addition, question = match.groups()
-        #matches "Dog of user eat at night" or "Dog of user eat at night?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, belong, rule_name, addition_prefix, addition, question = match.groups()
-        #matches "dog eat apples at night" or "dog eat apples at night?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, rule_name, value, addition_prefix, addition, question = match.groups()
-        #matches "Dog eat at night" or "Dog eat at night?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, rule_name, addition_prefix, addition, question = match.groups()
-        #matches "Dog of user eat apples" or "Dog of user eat apples?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, belong, rule_name, value, question = match.groups()
-        #matches "Dog of user eat" or "Dog of user eat?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, belong, rule_name, question = match.groups()
-        #matches "Dog eat apples" or "Dog eat apples?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, rule_name, value, question = match.groups()
-        #matches "Dog eat" or "Dog eat?"
-        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
-            subject, rule_name, question = match.groups()
+        self.form = None
+
+        tokens, words, keywords = self._tokenize(query)
+        fields = {}
+        if keywords:
+            fields = self._match_question(tokens, words, keywords) or {}
+        if not fields:
+            fields = self._match_statement(tokens, words) or {}
+
+        question = fields.get('question')
+        subject = fields.get('subject')
+        belong = fields.get('belong')
+        rule_name = fields.get('rule_name')
+        value = fields.get('value')
+        addition_prefix = fields.get('addition_prefix')
+        addition = fields.get('addition')
         
         rule_name = 'has' if rule_name == 'is' else rule_name
 
@@ -193,23 +560,97 @@ class Sentence():
 
 class Processor():
 
-    def __init__(self, rules : list[str]):
+    def __init__(self, rules : list[str], cache_size : int = 1024, materialized : bool = False,
+                 max_steps : int = 100000, timeout : float = 2.0, journal : Journal = None,
+                 compiled : tuple = None):
         self.rules = rules
-        self.engine = pl.KnowledgeBase("world")
-        self.engine(rules)
+        self.journal = journal
+        self.engine = KnowledgeBase(cache_size, materialized, max_steps, timeout)
+        # compiled is what compile_clauses(rules) returns, when the caller has it
+        if compiled is None:
+            compiled = compile_clauses(rules)
+        # The facts of data.yaml, and those of them that were also learned: a
+        # reload only removes a fact data.yaml dropped when nobody taught it.
+        self.data_facts = {(predicate, row) for predicate, rows in compiled[0].items() for row in rows}
+        self.taught = set()
+        if journal is not None:
+            journal.restore(self.engine, rules, compiled, self.taught)
+        else:
+            self.engine.restore(*compiled)
+        self.engine.materialize()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+    # applies the clauses of a data.yaml diff (see diff_data) to the engine;
+    # learned facts stay as they are
+    def update(self, change : 'DataChange'):
+        engine = self.engine
+        engine.remove_clauses(change.removed_rules, [fact for fact in change.removed_facts if fact not in self.taught])
+        for rule in change.added_rules:
+            engine.add_rule(rule)
+        for predicate, args in change.added_facts:
+            relation = engine.facts.get(predicate)
+            if relation is not None and args in relation:
+                self.taught.add((predicate, args))
+        if change.added_facts:
+            engine.add_facts(change.added_facts)
+        self.data_facts = {(predicate, row) for predicate, rows in change.data['compiled'][0].items() for row in rows}
+        self.rules = change.data['rules']
+        if self.journal is not None:
+            self.journal.source = self.rules
     
     def _add_rule(self, rule : str):
-        self.engine.add_kn([rule])
-        self.engine._cache = {}
-
-    def _question(self, question: str):
-        try:
-            result = self.engine.query(pl.Expr(question))
-            self.engine._cache = {}
-        except TypeError:
-            # If pytholog fails (e.g., due to an unexpected None), return an empty list.
-            return []
-        return result if result is not None else []
+        self.engine.add_clause(rule)
+
+    # only facts learned by the processor's own engine are journaled; a fact
+    # data.yaml already holds is journaled the first time it is taught, which
+    # is how the journal remembers it was
+    def _add_fact(self, predicate : str, args : tuple, engine : KnowledgeBase = None):
+        if engine is not None and engine is not self.engine:
+            engine.add_fact(predicate, args)
+            return
+        added = self.engine.add_fact(predicate, args)
+        if not added and (predicate, args) in self.data_facts and (predicate, args) not in self.taught:
+            self.taught.add((predicate, args))
+            added = True
+        if added and self.journal is not None:
+            self.journal.append(predicate, args)
+
+    # adds (predicate, args) facts batch_size at a time (see
+    # KnowledgeBase.add_facts), returns how many of them were new
+    def add_facts(self, facts, batch_size : int = 10000):
+        added = 0
+        batch = []
+        for fact in facts:
+            batch.append(fact)
+            if len(batch) >= batch_size:
+                added += self._add_batch(batch)
+                batch = []
+        if batch:
+            added += self._add_batch(batch)
+        return added
+
+    def _add_batch(self, batch : list[tuple[str, tuple]]):
+        delta = self.engine.add_facts(batch)
+        taught = [fact for fact in batch if fact in self.data_facts and fact not in self.taught]
+        self.taught.update(taught)
+        if self.journal is not None:
+            self.journal.extend(itertools.chain(((predicate, args) for predicate, rows in delta.items() for args in rows), taught))
+        return sum(len(rows) for rows in delta.values())
+
+    # the fact process_query learns from a statement, None if it learns nothing
+    def statement_fact(self, sen : Sentence):
+        if sen.stype != SentenceType.Statement or sen.rule_name is None:
+            return None
+        return sen.rule_name, tuple('_' if term is None else term for term in self._terms(sen))
+
+    def _question(self, predicate : str, args : tuple, engine : KnowledgeBase = None, limit : int = None):
+        return (self.engine if engine is None else engine).query(predicate, args, limit)
+
+    def _terms(self, sen : Sentence):
+        return (sen.subject, sen.belong, sen.value, sen.addition_prefix, sen.addition)
 
     
     def _convert_none_to_any_variable(self, sen : Sentence):
@@ -217,16 +658,16 @@ class Processor():
         converted = { key:'_' if value == None else value for (key,value) in field_dict.items()}
         return Sentence(**converted)
     
-    def process_query(self, sen : Sentence):
+    def process_query(self, sen : Sentence, engine : KnowledgeBase = None):
         #add more variativity by adding to data.yaml several predefined responses for certain situations
         reply = 'Thank you for information!'
         if sen.stype == SentenceType.Statement:
-            rule = f'{sen.rule_name}({sen.subject}, {sen.belong}, {sen.value}, {sen.addition_prefix}, {sen.addition})'
-            self._add_rule(rule)
+            fact = self.statement_fact(sen)
+            if fact is not None:
+                self._add_fact(*fact, engine)
         elif sen.stype == SentenceType.Question:
             sen = self._convert_none_to_any_variable(sen) 
-            question = f'{sen.rule_name}({sen.subject}, {sen.belong}, {sen.value}, {sen.addition_prefix}, {sen.addition})'
-            reply = self._question(question)
+            reply = self._question(sen.rule_name, self._terms(sen), engine, ANSWER_LIMITS.get(sen.stype))
         else:
             match sen.stype:
                 case SentenceType.WhatQuestion:
@@ -244,8 +685,7 @@ class Processor():
                 case SentenceType.WhoQuestion:
                     sen.subject = 'Var'
             sen = self._convert_none_to_any_variable(sen) 
-            question = f'{sen.rule_name}({sen.subject}, {sen.belong}, {sen.value}, {sen.addition_prefix}, {sen.addition})' 
-            reply = self._question(question)
+            reply = self._question(sen.rule_name, self._terms(sen), engine, ANSWER_LIMITS.get(sen.stype))
         
         return reply
 
@@ -257,7 +697,8 @@ class Translator():
         return val if val is not None else ""
         
 
-    def translate(self, sentence, reply):
+    # complete is False when resolution gave up before it had every answer
+    def translate(self, sentence, reply, complete : bool = True):
 
         subject = self.safe(sentence.subject)
         belong = self.safe(sentence.belong)
@@ -276,7 +717,7 @@ class Translator():
             return reply
         
         if not reply:
-            return "I could not find an answer."
+            return "I could not find an answer." if complete else TOO_BROAD
         
         extracted_replies = []
         for item in reply:
@@ -286,6 +727,10 @@ class Translator():
                 extracted_replies.append(item)
             else:
                 extracted_replies.append(str(item))
+        if ANSWER_LIMITS.get(sentence.stype) is None:
+            # answers come in the order they were learned; a list reads
+            # sorted, as it did when pytholog answered
+            extracted_replies.sort()
         reply_values = ", ".join(ans for ans in extracted_replies if ans)
 
         negative = reply_values.lower() in {"no", "none", ""}
@@ -358,11 +803,22 @@ class Translator():
         if sentence_str:
             sentence_str = sentence_str.replace('_',' ')
 
+        if sentence_str and not complete:
+            sentence_str += " " + PARTIAL
         return sentence_str
 
 
 #testing zone 	▓▒░(°◡°)░▒▓
 if __name__ == '__main__':
+    # the GUI toolkits are only loaded for the Tk front end
+    import customtkinter as ctk
+    import queue
+    import tkinter as tk
+
+    # frame timer period (about 60 frames per second) and typed letters per second
+    FRAME_MS = 16
+    TYPING_SPEED = 33
+
     lux = Lux(os.path.dirname(__file__) + '/data.yaml')
     print('LUX INITIALIZED')
 
@@ -434,24 +890,75 @@ if __name__ == '__main__':
     )
     send_button.pack(side="right", padx=10, pady=10)
 
-    # Function to Print Bot's Message Letter by Letter
-    def type_response(reply):
+    # Lux answers on a worker thread, in the order the queries were sent, and
+    # hands the replies back through a queue; Tk is only touched from the main
+    # thread. Replies are typed out by a frame timer that inserts all the
+    # letters due since the last frame at once, so a long reply costs one
+    # widget update per frame instead of one per letter. Escape (or a click in
+    # the conversation) skips the typing.
+    queries = queue.Queue()
+    replies = queue.Queue()
+    typing = deque()  # replies still to be typed, the first one in progress
+    typed = 0  # letters of typing[0] already shown
+    due = 0.0  # letters the timer owes, fractions carried between frames
+    last_frame = time.monotonic()
+
+    def answer_queries():
+        while True:
+            query = queries.get()
+            if query is None:
+                break
+            try:
+                reply = lux.think(query)
+            except Exception as error:
+                reply = f"Something went wrong: {error}"
+            replies.put(reply)
+
+    worker = threading.Thread(target=answer_queries, daemon=True)
+    worker.start()
+
+    def insert(*chunks):
         conversation.config(state='normal')
-        conversation.insert("end", "\n\n", "spacing")
-        conversation.insert("end", "LUX:\n", "bot_label")
+        conversation.insert("end", *chunks)
         conversation.config(state='disabled')
+        conversation.yview("end")
 
-        def type_effect():
-            conversation.config(state='normal')
-            for letter in reply:
-                conversation.insert("end", letter, "bot_message")
-                conversation.yview("end")
-                time.sleep(0.03)  # Adjust typing speed here
-                conversation.update()
-            conversation.insert("end", "\n", "bot_message")
-            conversation.config(state='disabled')
-
-        threading.Thread(target=type_effect, daemon=True).start()
+    # the rest of typing[0] and letters of the replies after it, up to count
+    def type_letters(count):
+        global typed
+        while typing and count > 0:
+            reply = typing[0]
+            if not typed:
+                insert("\n\n", "spacing", "LUX:\n", "bot_label")
+            chunk = reply[typed:typed + count]
+            typed += len(chunk)
+            count -= len(chunk)
+            if typed >= len(reply):
+                chunk += "\n"
+                typing.popleft()
+                typed = 0
+            insert(chunk, "bot_message")
+
+    def skip_typing(event=None):
+        type_letters(sum(len(reply) for reply in typing) + 1)
+
+    def render_frame():
+        global due, last_frame
+        now = time.monotonic()
+        while True:
+            try:
+                typing.append(replies.get_nowait())
+            except queue.Empty:
+                break
+        if typing:
+            due += (now - last_frame) * TYPING_SPEED
+            if due >= 1:
+                type_letters(int(due))
+                due -= int(due)
+        else:
+            due = 0.0
+        last_frame = now
+        app.after(FRAME_MS, render_frame)
 
     # Function to Send Messages
     def send_message():
@@ -459,20 +966,18 @@ if __name__ == '__main__':
         if not query:
             return
 
-        conversation.config(state='normal')
-        conversation.insert("end", "\n\n", "spacing")
-        conversation.insert("end", "You:\n", "user_label")
-        conversation.insert("end", f"{query}\n", "user_message")
-        conversation.config(state='disabled')
+        # the reply being typed is finished first so the turns do not mix
+        skip_typing()
+        insert("\n\n", "spacing", "You:\n", "user_label", f"{query}\n", "user_message")
         user_input.delete(0, "end")
-        conversation.yview("end")
 
         # Chatbot Response
-        reply = lux.think(query)
-        type_response(reply)
+        queries.put(query)
 
     # Bind "Enter" Key & Button Click to Send Message
     app.bind('<Return>', lambda event: send_message())
+    app.bind('<Escape>', skip_typing)
+    conversation.bind('<Button-1>', skip_typing)
     send_button.configure(command=send_message)
 
     # Styling Chat Bubbles
@@ -510,4 +1015,8 @@ if __name__ == '__main__':
     conversation.tag_configure("spacing", spacing1=5, spacing3=5)
 
     # Start the Main Loop
+    app.after(FRAME_MS, render_frame)
     app.mainloop()
+    queries.put(None)
+    worker.join()
+    lux.close()
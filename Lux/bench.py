@@ -0,0 +1,478 @@
+# Benchmarks for the Lux knowledge base.
+#
+#   python bench.py store [--sizes 1000,100000,1000000] [--repeat 200] [--baseline]
+#   python bench.py startup [--runs 20]
+#   python bench.py memory [--size 1000000]
+#   python bench.py plan [--sizes 1000,10000] [--repeat 20]
+#   python bench.py suite [--facts 10000] [--synonyms 1000] [--concats 1000] [--depth 3] [--fanout 3]
+#                         [--per-form 10] [--rounds 3] [--output results.json] [--compare old.json]
+#
+# "store" fills a knowledge base with N eat/5 facts next to the data.yaml rules
+# and reports the median latency of the questions Lux asks most often; the
+# ones Lux asks with an answer limit (Lux.ANSWER_LIMITS) are also timed without.
+# --baseline runs the same questions against a pytholog KnowledgeBase (rule
+# questions are skipped there: pytholog does not terminate on the has/5 rules).
+#
+# "startup" starts fresh interpreters that import Lux, build it from data.yaml
+# and answer one question, with and without the compiled data.yaml cache.
+#
+# "memory" measures the resident memory per fact of a million eat/5 facts in
+# a fresh interpreter, stored as interned int32 columns (knowledge.Relation)
+# and as the tuple rows with per-argument index lists it replaced, once with
+# a new entity on every row and once with 1000 entities that repeat. The
+# target is MEMORY_TARGET times less memory for a million facts whose atoms
+# repeat, and the run fails when they miss it. At a million facts the columns
+# took 10.3x less with repeated entities (523 -> 51 B/fact) and 2.4x less with
+# unique ones (655 -> 268 B/fact), where the strings themselves dominate.
+#
+# "plan" times rule questions over skewed has/5 facts (every entity a
+# carnivore, half of them yellow, three with a mane) with the body goals in
+# planned order (KnowledgeBase.plan) and in written order.
+#
+# "suite" builds Lux from a synthetic data.yaml world and times every stage of
+# think (preprocess, parse, process_query, translate and think itself) over a
+# query corpus that hits every parser form and every SentenceType. Results are
+# written as JSON; --compare prints the change against an earlier result file.
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import yaml
+import pytholog as pl
+import metrics
+import knowledge
+from dataclasses import replace
+from knowledge import KnowledgeBase
+from Lux import Lux, SentenceType, QUESTION_FORMS, STATEMENT_FORMS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATAFILE = HERE + '/data.yaml'
+CACHEFILE = HERE + '/__pycache__/data.yaml.lux.pickle'
+
+# run in a fresh interpreter by "startup", prints its timings as JSON
+STARTUP = """
+import sys, time, json
+start = time.perf_counter()
+import Lux
+imported = time.perf_counter()
+lux = Lux.Lux(sys.argv[1])
+built = time.perf_counter()
+lux.think('who is tiger?')
+replied = time.perf_counter()
+print(json.dumps({'import': imported - start, 'init': built - imported, 'first reply': replied - built,
+                  'total': replied - start, 'gui loaded': 'tkinter' in sys.modules}))
+"""
+
+# how many times less memory per fact the columns must take than tuple rows
+# when the atoms repeat, from MEMORY_TARGET_SIZE facts on (below that the
+# symbol table and the interpreter weigh in, and the run only reports)
+MEMORY_TARGET = 10.0
+MEMORY_TARGET_SIZE = 1000000
+
+# run in a fresh interpreter by "memory", prints the bytes per fact
+MEMORY = """
+import os, sys, gc
+from knowledge import KnowledgeBase
+layout, distribution, size = sys.argv[1], sys.argv[2], int(sys.argv[3])
+
+def rss():
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def facts():
+    for i in range(size):
+        entity = f'entity{i}' if distribution == 'unique' else f'entity{i % 1000}'
+        yield 'eat', (entity, 'user' if i % 3 == 0 else '_', f'food{i % 499}', 'at', f'time{i % 7}')
+
+# the layout before the columns: rows, a set of them and a list of row ids per value
+def tuples():
+    rows, known, index = [], set(), [{} for _ in range(5)]
+    for _, row in facts():
+        if row not in known:
+            known.add(row)
+            for position, value in enumerate(row):
+                index[position].setdefault(value, []).append(len(rows))
+            rows.append(row)
+    return rows, known, index
+
+gc.collect()
+before = rss()
+if layout == 'columns':
+    kb = KnowledgeBase(cache_size=0)
+    for predicate, row in facts():
+        kb.add_fact(predicate, row)
+else:
+    store = tuples()
+gc.collect()
+print((rss() - before) / size)
+"""
+
+FOODS = 500
+TIMES = 7
+
+
+def load_rules():
+    with open(DATAFILE, 'r') as file:
+        return yaml.safe_load(file)['rules']
+
+
+def synthetic_facts(size : int):
+    for i in range(size):
+        yield 'eat', (f'entity{i}', 'user' if i % 3 == 0 else '_', f'food{i % FOODS}', 'at', f'time{i % TIMES}')
+
+
+# (label, predicate, args, limit) in the shape Processor.process_query builds
+# them, limit as in Lux.ANSWER_LIMITS
+def questions(size : int):
+    entity = f'entity{size // 2}'
+    return [
+        ('who eat food42?', 'eat', ('Var', '_', 'food42', '_', '_'), None),
+        (f'which {entity} eat?', 'eat', (entity, 'Var', '_', '_', '_'), None),
+        (f'what {entity} eat?', 'eat', (entity, '_', 'Var', '_', '_'), None),
+        (f'when {entity} eat?', 'eat', (entity, '_', '_', 'at', 'Var'), 2),
+        (f'{entity} eat food? (no)', 'eat', (entity, '_', 'food', '_', '_'), 1),
+        ('user eat food42? (yes)', 'eat', ('_', 'user', 'food42', '_', '_'), 1),
+        ('when user eat food42?', 'eat', ('_', 'user', 'food42', 'at', 'Var'), 2),
+        ('who is tiger?', 'has', ('Var', '_', 'tiger', '_', '_'), None),
+    ]
+
+
+def median_latency(ask, repeat : int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ask()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_store(sizes : list[int], repeat : int, baseline : bool):
+    rules = load_rules()
+    ruled = {pl.Fact(rule).lh.predicate for rule in rules if ':-' in rule}
+    for size in sizes:
+        start = time.perf_counter()
+        kb = KnowledgeBase(cache_size=0)  # time resolution, not the answer cache
+        kb(rules)
+        for predicate, args in synthetic_facts(size):
+            kb.add_fact(predicate, args)
+        print(f'\n{size} facts, loaded in {time.perf_counter() - start:.2f}s')
+
+        engine = None
+        if baseline:
+            start = time.perf_counter()
+            engine = pl.KnowledgeBase('baseline')
+            engine(rules + [f'{p}({", ".join(args)})' for p, args in synthetic_facts(size)])
+            print(f'pytholog loaded in {time.perf_counter() - start:.2f}s')
+
+        for label, predicate, args, limit in questions(size):
+            latency = median_latency(lambda: kb.query(predicate, args, limit), repeat)
+            line = f'  {label:<28} {latency * 1e6:12.1f} us'
+            if limit is not None:
+                line += f'   all answers {median_latency(lambda: kb.query(predicate, args), repeat) * 1e6:12.1f} us'
+            if engine is not None and predicate not in ruled:
+                expr = pl.Expr(f'{predicate}({", ".join(args)})')
+                def ask():
+                    engine._cache = {}
+                    engine.query(expr)
+                line += f'   pytholog {median_latency(ask, max(1, repeat // 20)) * 1e6:12.1f} us'
+            print(line)
+
+
+def bench_startup(runs : int):
+    for label, cold in (('cold (no data.yaml cache)', True), ('warm (cached data.yaml)', False)):
+        samples = []
+        for _ in range(runs):
+            if cold and os.path.exists(CACHEFILE):
+                os.remove(CACHEFILE)
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', STARTUP, DATAFILE], cwd=HERE,
+                                    capture_output=True, text=True, check=True).stdout
+            timings = json.loads(output)
+            timings['process'] = time.perf_counter() - start
+            samples.append(timings)
+        print(f'\n{label}, median of {runs} runs')
+        for key in ('import', 'init', 'first reply', 'total', 'process'):
+            print(f'  {key:<12} {statistics.median(sample[key] for sample in samples) * 1e3:9.1f} ms')
+        print(f'  gui loaded   {any(sample["gui loaded"] for sample in samples)}')
+
+
+def skewed_facts(size : int):
+    for i in range(size):
+        yield 'has', (f'entity{i}', '_', 'carnivore', '_', '_')
+        if i % 2 == 0:
+            yield 'has', (f'entity{i}', '_', 'yellow', '_', '_')
+    for i in (0, 2, 4):
+        yield 'has', (f'entity{i}', '_', 'mane', '_', '_')
+
+
+def bench_plan(sizes : list[int], repeat : int):
+    rules = load_rules()
+    gain = knowledge.PLAN_GAIN
+    for size in sizes:
+        print(f'\n{size} carnivores, {(size + 1) // 2} yellow, 3 with a mane')
+        cases = [('who is lion?', ('Var', '_', 'lion', '_', '_')),
+                 ('is entity2 lion?', ('entity2', '_', 'lion', '_', '_')),
+                 ('who is tiger?', ('Var', '_', 'tiger', '_', '_'))]
+        latencies = {}
+        for order, planned_gain in (('planned', gain), ('written', float('inf'))):
+            knowledge.PLAN_GAIN = planned_gain
+            try:
+                kb = KnowledgeBase(cache_size=0)  # time resolution, not the answer cache
+                kb(rules)
+                kb.add_facts(skewed_facts(size))
+                for label, args in cases:
+                    kb.query('has', args)  # plans once
+                    samples = repeat if order == 'planned' else max(1, repeat // 10)
+                    latencies[label, order] = median_latency(lambda: kb.query('has', args), samples), kb.last_steps
+            finally:
+                knowledge.PLAN_GAIN = gain
+        for label, _ in cases:
+            (planned, steps), (written, written_steps) = latencies[label, 'planned'], latencies[label, 'written']
+            print(f'  {label:<18} planned {planned * 1e3:10.2f} ms {steps:>8} steps'
+                  f'   written {written * 1e3:10.2f} ms {written_steps:>8} steps   {written / planned:8.1f}x')
+
+
+# A data.yaml world: facts entities with has/5 traits and eat/5 meals at a
+# time or in a place, synonyms (aliases of entities) and concats (two-word
+# dishes). Rules are stacked depth levels of fanout classes; every class has
+# fanout alternative rules, each joining a class of the level below with a trait.
+def synthetic_world(facts : int, synonyms : int, concats : int, depth : int, fanout : int, seed : int = 0):
+    rng = random.Random(seed)
+    vocabulary = {
+        'entities': [f'entity{i}' for i in range(max(1, facts // 10))],
+        'traits': [f'trait{i}' for i in range(max(2, 4 * fanout))],
+        'foods': [f'food{i}' for i in range(max(1, facts // 50))],
+        'dishes': [f'dish{i} style{i % 7}' for i in range(concats)],
+        'aliases': [f'alias{i}' for i in range(synonyms)],
+        'times': [f'time{i}' for i in range(TIMES)],
+        'places': [f'place{i}' for i in range(TIMES)],
+        'classes': [],
+    }
+    rules = []
+    below = vocabulary['traits']
+    for level in range(1, depth + 1):
+        classes = [f'class{level}x{k}' for k in range(fanout)]
+        for name in classes:
+            for _ in range(fanout):
+                rules.append(f'has(Entity,_,{name},_,_) :- has(Entity,_,{rng.choice(below)},_,_), '
+                             f'has(Entity,_,{rng.choice(vocabulary["traits"])},_,_)')
+        vocabulary['classes'] += classes
+        below = classes
+
+    meals = vocabulary['foods'] + [dish.replace(' ', '_') for dish in vocabulary['dishes']]
+    for i in range(facts):
+        entity = rng.choice(vocabulary['entities'])
+        if i % 2:
+            rules.append(f'has({entity}, _, {rng.choice(vocabulary["traits"])}, _, _)')
+        elif i % 4:
+            rules.append(f'eat({entity}, _, {rng.choice(meals)}, at, {rng.choice(vocabulary["times"])})')
+        else:
+            rules.append(f'eat({entity}, user, {rng.choice(meals)}, in, {rng.choice(vocabulary["places"])})')
+
+    world = {
+        'synonyms': {alias: rng.choice(vocabulary['entities']) for alias in vocabulary['aliases']},
+        'concats': vocabulary['dishes'],
+        'rules': rules,
+    }
+    world['synonyms'].update({'is': 'is', 'are': 'is', 'my': 'user', 'i': 'user'})
+    return world, vocabulary
+
+
+# words for the slots of a parser form
+def fill_form(form : tuple, question : str, vocabulary : dict, rng : random.Random):
+    rule = 'eat' if 'addition' in form or rng.random() < 0.5 else 'is'
+    prefix = rng.choice(('at', 'in'))
+    words = {
+        'question': question,
+        'subject': rng.choice(vocabulary['entities'] + vocabulary['aliases']),
+        'of': 'of',
+        'belong': rng.choice(('user', 'my')),
+        'rule_name': rule,
+        'value': rng.choice(vocabulary['foods'] + vocabulary['dishes'] if rule == 'eat'
+                            else vocabulary['traits'] + vocabulary['classes']),
+        'addition_prefix': prefix,
+        'addition': rng.choice(vocabulary['times'] if prefix == 'at' else vocabulary['places']),
+    }
+    return ' '.join(words[slot] for slot in form)
+
+
+# (form label, query) pairs, per_form of each question form with each of its
+# question words and of each statement form, as statement and as yes/no question
+def query_corpus(vocabulary : dict, per_form : int, seed : int = 0):
+    rng = random.Random(seed)
+    corpus = []
+    for question_words, forms in QUESTION_FORMS:
+        for question in question_words:
+            for number, form in enumerate(forms):
+                corpus += [(f'{question}/{number}', fill_form(form, question, vocabulary, rng) + '?')
+                           for _ in range(per_form)]
+    for number, form in enumerate(STATEMENT_FORMS):
+        corpus += [(f'statement/{number}', fill_form(form, None, vocabulary, rng)) for _ in range(per_form)]
+        corpus += [(f'yes-no/{number}', fill_form(form, None, vocabulary, rng) + '?') for _ in range(per_form)]
+    corpus += [('greeting', 'hello')] * per_form
+    rng.shuffle(corpus)
+    return corpus
+
+
+# metrics.summary of nanosecond samples, in the keys of the result files
+def summary(samples : list[int]):
+    stats = metrics.summary([sample / 1e3 for sample in samples])
+    return {'calls': stats['count'], 'throughput': len(samples) / (sum(samples) / 1e9),
+            'p50_us': stats['p50'], 'p95_us': stats['p95'], 'p99_us': stats['p99'], 'mean_us': stats['mean']}
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_memory(size : int):
+    print(f'resident memory of {size} eat/5 facts')
+    for distribution in ('unique', 'repeated'):
+        per_fact = {}
+        for layout in ('tuples', 'columns'):
+            output = subprocess.run([sys.executable, '-c', MEMORY, layout, distribution, str(size)], cwd=HERE,
+                                    capture_output=True, text=True, check=True).stdout
+            per_fact[layout] = float(output)
+        ratio = per_fact['tuples'] / per_fact['columns']
+        print(f'  {distribution:<9} entities: tuple rows {per_fact["tuples"]:6.0f} B/fact, '
+              f'int32 columns {per_fact["columns"]:6.0f} B/fact ({ratio:.1f}x less)')
+    if size < MEMORY_TARGET_SIZE:
+        return
+    if ratio < MEMORY_TARGET:
+        sys.exit(f'repeated entities: {ratio:.1f}x less memory, the target is {MEMORY_TARGET:.0f}x')
+    print(f'  target of {MEMORY_TARGET:.0f}x less for repeated entities met')
+
+
+def bench_suite(args):
+    world, vocabulary = synthetic_world(args.facts, args.synonyms, args.concats, args.depth, args.fanout, args.seed)
+    corpus = query_corpus(vocabulary, args.per_form, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        datafile = os.path.join(directory, 'data.yaml')
+        with open(datafile, 'w') as file:
+            yaml.safe_dump(world, file)
+        start = time.perf_counter()
+        lux = Lux(datafile)
+        build = time.perf_counter() - start
+        # think gets a Lux of its own, or it would answer from the cache the
+        # stage by stage run just filled
+        whole = Lux(datafile)
+    if args.no_cache:
+        lux.processor.engine.cache.size = whole.processor.engine.cache.size = 0
+
+    stages = {name: [] for name in ('preprocess', 'parse', 'process_query', 'translate', 'think')}
+    coverage = {}
+    clock = time.perf_counter_ns
+    for _ in range(args.rounds):
+        for label, query in corpus:
+            t0 = clock()
+            preprocessed = lux.lexer.preprocess(query)
+            t1 = clock()
+            stages['preprocess'].append(t1 - t0)
+            if preprocessed != 'hello':
+                t0 = clock()
+                sentence = lux.parser.parse(preprocessed)
+                t1 = clock()
+                stages['parse'].append(t1 - t0)
+                sentence = replace(sentence)
+                t0 = clock()
+                reply = lux.processor.process_query(sentence)
+                t1 = clock()
+                lux.translator.translate(sentence, reply)
+                t2 = clock()
+                stages['process_query'].append(t1 - t0)
+                stages['translate'].append(t2 - t1)
+                stype = sentence.stype.name
+            else:
+                stype = 'Greeting'
+            t0 = clock()
+            whole.think(query)
+            stages['think'].append(clock() - t0)
+            coverage.setdefault(stype, set()).add(label)
+
+    missing = [stype.name for stype in SentenceType if stype.name not in coverage]
+    results = {
+        'meta': {'commit': commit(), 'python': platform.python_version(), 'machine': platform.machine(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'build_s': build, 'clauses': len(lux.processor.engine),
+                 'parameters': {name: value for name, value in vars(args).items() if name not in ('command', 'output', 'compare')}},
+        'coverage': {stype: sorted(labels) for stype, labels in sorted(coverage.items())},
+        'stages': {name: summary(samples) for name, samples in stages.items()},
+    }
+
+    print(f'world: {len(world["rules"])} clauses, {len(world["synonyms"])} synonyms, {len(world["concats"])} concats, '
+          f'built in {build:.2f}s; {len(corpus)} queries x {args.rounds} rounds')
+    if missing:
+        print(f'  sentence types not covered: {", ".join(missing)}')
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)['stages']
+    for name, stats in results['stages'].items():
+        line = (f'  {name:<14} {stats["throughput"]:12.0f}/s   p50 {stats["p50_us"]:9.1f} us   '
+                f'p95 {stats["p95_us"]:9.1f} us   p99 {stats["p99_us"]:9.1f} us')
+        if previous and name in previous:
+            line += f'   p50 x{stats["p50_us"] / previous[name]["p50_us"]:.2f}'
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'results written to {args.output}')
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Lux knowledge base benchmarks')
+    commands = argparser.add_subparsers(dest='command', required=True)
+
+    store = commands.add_parser('store', help='question latency against the size of the fact store')
+    store.add_argument('--sizes', default='1000,100000,1000000', help='comma separated fact counts')
+    store.add_argument('--repeat', type=int, default=200, help='samples per question')
+    store.add_argument('--baseline', action='store_true', help='also time pytholog (slow on large sizes)')
+
+    startup = commands.add_parser('startup', help='cold start: import Lux, build it and answer one question')
+    startup.add_argument('--runs', type=int, default=20, help='interpreters started per case')
+
+    memory = commands.add_parser('memory', help='resident memory per fact of the fact store')
+    memory.add_argument('--size', type=int, default=1000000, help='facts stored')
+
+    plan = commands.add_parser('plan', help='rule questions over skewed facts, planned against written goal order')
+    plan.add_argument('--sizes', default='1000,10000', help='comma separated entity counts')
+    plan.add_argument('--repeat', type=int, default=20, help='samples per question in planned order')
+
+    suite = commands.add_parser('suite', help='per-stage latency of think on a synthetic world')
+    suite.add_argument('--facts', type=int, default=10000, help='ground facts in the world')
+    suite.add_argument('--synonyms', type=int, default=1000)
+    suite.add_argument('--concats', type=int, default=1000)
+    suite.add_argument('--depth', type=int, default=3, help='levels of rules above the facts')
+    suite.add_argument('--fanout', type=int, default=3, help='classes per level and rules per class')
+    suite.add_argument('--per-form', type=int, default=10, help='queries per parser form')
+    suite.add_argument('--rounds', type=int, default=3, help='passes over the query corpus')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--no-cache', action='store_true', help='turn off the answer cache')
+    suite.add_argument('--output', help='write the results as JSON to this file')
+    suite.add_argument('--compare', help='JSON results of an earlier run to compare with')
+
+    args = argparser.parse_args()
+    if args.command == 'store':
+        bench_store([int(size) for size in args.sizes.split(',')], args.repeat, args.baseline)
+    elif args.command == 'startup':
+        bench_startup(args.runs)
+    elif args.command == 'memory':
+        bench_memory(args.size)
+    elif args.command == 'plan':
+        bench_plan([int(size) for size in args.sizes.split(',')], args.repeat)
+    elif args.command == 'suite':
+        bench_suite(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# Bulk loading of facts into Lux.
+#
+#   python ingest.py FILE [FILE ...] [--format text|csv|jsonl] [--state-dir DIR] [--batch-size 10000]
+#
+# text files hold one statement per line ("dog eat apples at night"), read the
+# way Lux.think reads them. csv and jsonl files hold rows already in the
+# (rule, subject, belong, value, addition_prefix, addition) form: csv with an
+# optional header of these names, jsonl with a list or an object per line.
+# Every field is read the way Lux.think reads a word: lowercased, with the
+# synonyms and joined phrases of data.yaml ("Intelligent systems" becomes
+# intelligent_systems). Empty fields become _; a row with a field that is not
+# a single atom after that is skipped. Facts are added in batches and
+# deduplicated; with --state-dir they are journaled and a snapshot is written
+# at the end, so the next Lux(state_dir=...) starts with them.
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from Lux import Lux, MEMO_SIZE
+from knowledge import ANY, is_variable
+
+DATAFILE = os.path.dirname(os.path.abspath(__file__)) + '/data.yaml'
+FIELDS = ('rule', 'subject', 'belong', 'value', 'addition_prefix', 'addition')
+
+
+class Counts():
+
+    def __init__(self):
+        self.read = 0
+        self.skipped = 0
+
+
+# facts of statement lines; lines Lux would not learn from (questions,
+# greetings, sentences without a rule) are counted as skipped
+def statement_facts(lux : Lux, lines, counts : Counts):
+    preprocess, parse, fact_of = lux.lexer.preprocess, lux.parser.parse, lux.processor.statement_fact
+    for line in lines:
+        if not line.strip():
+            continue
+        counts.read += 1
+        preprocessed = preprocess(line)
+        fact = None
+        if preprocessed != 'hi' and preprocessed != 'hello':
+            fact = fact_of(parse(preprocessed))
+        if fact is None:
+            counts.skipped += 1
+        else:
+            yield fact
+
+
+# the atom the text of a field stands for, None when it is not a single atom
+def atom(lux : Lux, text : str):
+    words = lux.lexer.preprocess(text).split()
+    if not words:
+        return ANY
+    if len(words) > 1 or (is_variable(words[0]) and words[0] != ANY):
+        return None
+    return words[0]
+
+
+# the fact of a row, None when one of its fields is not a single atom. atoms
+# keeps the atoms of field texts seen before, which come back row after row.
+def row_fact(lux : Lux, row, atoms : dict = None):
+    if isinstance(row, dict):
+        row = [row.get(field) for field in FIELDS]
+    if len(row) != len(FIELDS):
+        raise ValueError(f'expected {len(FIELDS)} fields {FIELDS}, got {row!r}')
+    if atoms is None:
+        atoms = {}
+    values = []
+    for value in row:
+        text = '' if value is None else str(value)
+        normalized = atoms.get(text, False)
+        if normalized is False:
+            if len(atoms) >= MEMO_SIZE:
+                atoms.clear()
+            normalized = atoms[text] = atom(lux, text)
+        values.append(normalized)
+    rule, *terms = values
+    if rule == ANY:
+        raise ValueError(f'row without a rule: {row!r}')
+    if rule is None or None in terms:
+        return None
+    return ('has' if rule == 'is' else rule), tuple(terms)
+
+
+def row_facts(lux : Lux, rows, counts : Counts):
+    atoms = {}
+    for row in rows:
+        counts.read += 1
+        fact = row_fact(lux, row, atoms)
+        if fact is None:
+            counts.skipped += 1
+        else:
+            yield fact
+
+
+def csv_rows(file):
+    rows = csv.reader(file)
+    for row in rows:
+        if row and tuple(field.strip() for field in row) != FIELDS:
+            yield row
+        break
+    for row in rows:
+        if row:
+            yield row
+
+
+def jsonl_rows(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def facts_of(lux : Lux, path : str, format : str, counts : Counts):
+    if format is None:
+        format = {'.csv': 'csv', '.jsonl': 'jsonl'}.get(os.path.splitext(path)[1], 'text')
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        if format == 'text':
+            yield from statement_facts(lux, file, counts)
+        elif format == 'csv':
+            yield from row_facts(lux, csv_rows(file), counts)
+        else:
+            yield from row_facts(lux, jsonl_rows(file), counts)
+
+
+def ingest(lux : Lux, paths : list[str], format : str = None, batch_size : int = 10000):
+    counts = Counts()
+    start = time.perf_counter()
+    added = 0
+    for path in paths:
+        added += lux.processor.add_facts(facts_of(lux, path, format, counts), batch_size)
+    if added and lux.processor.journal is not None:
+        lux.processor.journal.snapshot(wait=True)
+    seconds = time.perf_counter() - start
+    return {'read': counts.read, 'added': added, 'skipped': counts.skipped,
+            'duplicates': counts.read - counts.skipped - added, 'seconds': seconds,
+            'facts_per_second': added / seconds if seconds else 0.0,
+            'rows_per_second': counts.read / seconds if seconds else 0.0}
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='bulk load facts into Lux')
+    argparser.add_argument('files', nargs='+')
+    argparser.add_argument('--format', choices=('text', 'csv', 'jsonl'), help='by file extension when not given')
+    argparser.add_argument('--state-dir', help='journal the facts here (see journal.Journal)')
+    argparser.add_argument('--data', default=DATAFILE)
+    argparser.add_argument('--batch-size', type=int, default=10000)
+    args = argparser.parse_args()
+
+    lux = Lux(args.data, state_dir=args.state_dir)
+    try:
+        report = ingest(lux, args.files, args.format, args.batch_size)
+    except ValueError as error:
+        sys.exit(f'ingest: {error}')
+    finally:
+        lux.close()
+    print(f'{report["read"]} read, {report["added"]} new, {report["duplicates"]} duplicates, '
+          f'{report["skipped"]} skipped in {report["seconds"]:.2f}s: '
+          f'{report["facts_per_second"]:.0f} new facts/s, {report["rows_per_second"]:.0f} rows read/s')
+
+
+if __name__ == '__main__':
+    main()
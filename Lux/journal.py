@@ -0,0 +1,212 @@
+import os
+import json
+import pickle
+import threading
+from knowledge import KnowledgeBase, compile_clauses, thaw
+
+SNAPSHOT = 'snapshot.bin'
+JOURNAL = 'journal.log'
+# the journal a snapshot that is still being written replaces
+ROTATED = 'journal.log.1'
+FORMAT = 1
+
+
+class Journal():
+
+    # Keeps the facts Lux learns across restarts. Every new fact is appended to
+    # journal.log as a JSON line with a sequence number and handed to the OS
+    # at once, so a crash of the process loses nothing; the file is fsynced
+    # every sync_every records and by a timer thread every sync_interval
+    # seconds, so a crash of the machine loses at most that much. Every
+    # snapshot_every records the whole knowledge base is written to
+    # snapshot.bin (pickled rows and compiled rules) and the journal starts
+    # over. Only a copy of the fact columns is taken on the thread that
+    # learns (a memcpy per column); the rows are built, pickled and fsynced
+    # by a writer thread, so the cost that grows with the knowledge base stays
+    # off the query path. Until the snapshot is on disk the records it holds
+    # stay in journal.log.1.
+    def __init__(self, directory : str, sync_every : int = 64, sync_interval : float = 1.0,
+                 snapshot_every : int = 100000):
+        self.directory = directory
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        self.sequence = 0
+        self.kb = None
+        self.source = None
+        self.taught = set()
+        self._source_facts = set()
+        self._file = None
+        self._pending = 0
+        self._since_snapshot = 0
+        # fsync and the file swap of snapshot() happen under _lock, the
+        # timer thread runs until _closing is set
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._timer = None
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name : str):
+        return os.path.join(self.directory, name)
+
+    # fills kb from the latest snapshot and the journal records written after
+    # it. The compiled rules of the snapshot are used as long as the data.yaml
+    # rules (source) did not change; otherwise the rules are parsed again and
+    # only the learned facts of the snapshot are kept. taught gets the
+    # data.yaml facts that were also learned (see Processor.taught).
+    def restore(self, kb : KnowledgeBase, source : list[str], compiled : tuple = None, taught : set = None):
+        self.kb, self.source = kb, source
+        self.taught = taught = set() if taught is None else taught
+        if compiled is None:
+            compiled = compile_clauses(source)
+        self._source_facts = {(predicate, row) for predicate, rows in compiled[0].items() for row in rows}
+        state = None
+        if os.path.exists(self._path(SNAPSHOT)):
+            with open(self._path(SNAPSHOT), 'rb') as file:
+                state = pickle.load(file)
+            if state.get('format') != FORMAT:
+                state = None
+
+        if state is not None and state['source'] == source:
+            kb.restore(state['facts'], state['rules'])
+            self.sequence = state['sequence']
+            taught.update(state.get('taught', ()))
+        else:
+            kb.restore(*compiled)
+            if state is not None:
+                self.sequence = state['sequence']
+                old = {predicate: set(rows) for predicate, rows in compile_clauses(state['source'])[0].items()}
+                learned = set(state.get('taught', ()))
+                for predicate, rows in state['facts'].items():
+                    for row in rows:
+                        if row not in old.get(predicate, ()) or (predicate, row) in learned:
+                            kb.add_fact(predicate, row)
+                            if (predicate, row) in self._source_facts:
+                                taught.add((predicate, row))
+
+        self._replay(kb, ROTATED)
+        self._replay(kb, JOURNAL)
+        if os.path.exists(self._path(ROTATED)):
+            # the snapshot that was to replace journal.log.1 never made it:
+            # its records go on in one journal
+            with open(self._path(ROTATED), 'ab') as rotated:
+                if os.path.exists(self._path(JOURNAL)):
+                    with open(self._path(JOURNAL), 'rb') as file:
+                        rotated.write(file.read())
+                rotated.flush()
+                os.fsync(rotated.fileno())
+            os.replace(self._path(ROTATED), self._path(JOURNAL))
+        self._file = open(self._path(JOURNAL), 'a', encoding='utf-8')
+        self._timer = threading.Thread(target=self._sync_periodically, name='lux-journal', daemon=True)
+        self._timer.start()
+
+    def _sync_periodically(self):
+        while not self._closing.wait(self.sync_interval):
+            self.sync()
+
+    def _replay(self, kb : KnowledgeBase, name : str):
+        if not os.path.exists(self._path(name)):
+            return
+        offset = 0
+        with open(self._path(name), 'rb') as file:
+            for line in file:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('unterminated record')
+                    sequence, predicate, args = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the journal: cut it off so new
+                    # records do not follow it
+                    os.truncate(self._path(name), offset)
+                    break
+                offset += len(line)
+                if sequence > self.sequence:
+                    kb.add_fact(predicate, tuple(args))
+                    if (predicate, tuple(args)) in self._source_facts:
+                        self.taught.add((predicate, tuple(args)))
+                    self.sequence = sequence
+                    self._since_snapshot += 1
+
+    def append(self, predicate : str, args : tuple):
+        self.sequence += 1
+        self._file.write(json.dumps([self.sequence, predicate, args]) + '\n')
+        self._file.flush()
+        with self._lock:
+            self._pending += 1
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+        elif self._pending >= self.sync_every:
+            self.sync()
+
+    # appends many facts with a single sync at the end
+    def extend(self, facts):
+        lines = []
+        for predicate, args in facts:
+            self.sequence += 1
+            lines.append(json.dumps([self.sequence, predicate, args]) + '\n')
+        self._file.write(''.join(lines))
+        self._file.flush()
+        with self._lock:
+            self._pending += len(lines)
+        self._since_snapshot += len(lines)
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+        else:
+            self.sync()
+
+    def sync(self):
+        with self._lock:
+            if self._pending and self._file is not None:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+
+    # starts writing a snapshot, with wait until it is on disk. While the
+    # last one is still being written a snapshot without wait is left to the
+    # next record.
+    def snapshot(self, wait : bool = False):
+        if self._writer is not None and self._writer.is_alive() and not wait:
+            return
+        self.wait()
+        self.sync()
+        frozen = self.kb.frozen()
+        state = {'format': FORMAT, 'sequence': self.sequence, 'source': self.source, 'taught': list(self.taught)}
+        with self._lock:
+            self._file.close()
+            os.replace(self._path(JOURNAL), self._path(ROTATED))
+            self._file = open(self._path(JOURNAL), 'w', encoding='utf-8')
+        self._since_snapshot = 0
+        self._writer = threading.Thread(target=self._write, args=(state, frozen), name='lux-snapshot', daemon=True)
+        self._writer.start()
+        if wait:
+            self.wait()
+
+    # blocks until the snapshot being written, if any, is on disk
+    def wait(self):
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def _write(self, state : dict, frozen : tuple):
+        state['facts'], state['rules'] = thaw(frozen)
+        temporary = self._path(SNAPSHOT + '.tmp')
+        with open(temporary, 'wb') as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self._path(SNAPSHOT))
+        # records up to state['sequence'] are skipped on restore, so a crash
+        # before journal.log.1 is gone only costs a longer replay
+        os.remove(self._path(ROTATED))
+
+    def close(self):
+        self.wait()
+        self._closing.set()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,1115 @@
+import time
+import heapq
+import bisect
+import itertools
+from array import array
+from collections import OrderedDict
+
+# anonymous variable: matches anything and never binds
+ANY = '_'
+
+# built-in predicates that are evaluated instead of looked up
+BUILTINS = {'neq'}
+
+# longest index bucket Relation scans for a duplicate row before it keeps a
+# hash table of its rows
+SCAN_LIMIT = 64
+
+# Relation.slots entries that hold no row
+EMPTY = -1
+DELETED = -2
+
+# rows Search matches a goal against between two looks at the clock
+ROW_CHECK = 256
+
+# a rule body is only proven in another order than the written one when that
+# is estimated to take this many times less work (the order of the answers
+# changes with it)
+PLAN_GAIN = 4.0
+
+
+# same convention as pytholog: variables start with an uppercase letter or _
+def is_variable(term : str):
+    return term[:1].isupper() or term[:1] == ANY
+
+
+def walk(term : str, subst : dict):
+    while term in subst:
+        term = subst[term]
+    return term
+
+
+# unifies two argument tuples under subst, returns the extended substitution
+# (subst itself is never modified) or None when they do not unify
+def unify(left : tuple, right : tuple, subst : dict):
+    if len(left) != len(right):
+        return None
+    extended = subst
+    for a, b in zip(left, right):
+        a, b = walk(a, extended), walk(b, extended)
+        if a == b or a == ANY or b == ANY:
+            continue
+        if extended is subst:
+            extended = dict(subst)
+        if is_variable(a):
+            extended[a] = b
+        elif is_variable(b):
+            extended[b] = a
+        else:
+            return None
+    return extended
+
+
+class Symbols():
+
+    # interned atoms: every distinct string gets a small integer id, so a
+    # fact is stored as ids and each string exists once
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name : str):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return symbol
+
+
+class Relation():
+
+    # Ground facts of one predicate, stored by column: one int32 array of
+    # symbol ids per argument position, and per position a hash index from
+    # symbol id to the ids of the rows holding it (an int for a single row,
+    # an int32 array past that). A fact may hold _ in a position, which
+    # matches any value. Rows become string tuples only when they are read.
+    def __init__(self, arity : int, symbols : Symbols = None):
+        self.arity = arity
+        self.symbols = symbols if symbols is not None else Symbols()
+        self.columns = [array('i') for _ in range(arity)]
+        self.index = [{} for _ in range(arity)]
+        self.size = 0
+        # open addressing table of row ids by the hash of their symbol ids,
+        # only built for relations where even the smallest index bucket is
+        # too long to scan for duplicates; used counts the slots that are not
+        # EMPTY
+        self.slots = None
+        self.used = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        names = self.symbols.names
+        return (tuple(names[symbol] for symbol in row) for row in zip(*self.columns))
+
+    def __contains__(self, row : tuple):
+        ids = self.symbols.ids
+        symbols = [ids.get(value) for value in row]
+        return None not in symbols and self._stored(symbols)
+
+    @property
+    def rows(self):
+        return list(self)
+
+    # whether a row with these symbol ids is stored: the rows of the smallest
+    # index bucket of its values are compared
+    def _stored(self, symbols : list[int]):
+        if self.slots is not None:
+            return self.slots[self._find(symbols)] != EMPTY
+        best = None
+        for index, symbol in zip(self.index, symbols):
+            bucket = index.get(symbol)
+            if bucket is None:
+                return False
+            if type(bucket) is int:
+                best = (bucket,)
+                break
+            if best is None or len(bucket) < len(best):
+                best = bucket
+        if best is None:
+            return self.size > 0
+        if len(best) > SCAN_LIMIT:
+            self._rehash()
+            return self.slots[self._find(symbols)] != EMPTY
+        for row_id in best:
+            for column, symbol in zip(self.columns, symbols):
+                if column[row_id] != symbol:
+                    break
+            else:
+                return True
+        return False
+
+    def add(self, row : tuple):
+        if len(row) != self.arity:
+            raise ValueError(f'{len(row)} arguments for a relation of {self.arity}')
+        ids = self.symbols.ids
+        symbols = [ids.get(value) for value in row]
+        slot = None
+        if None in symbols:
+            # a new atom: the row cannot be stored yet
+            intern = self.symbols.intern
+            symbols = [intern(value) for value in row]
+        elif self.slots is not None:
+            slot = self._find(symbols)
+            if self.slots[slot] != EMPTY:
+                return False
+        elif self._stored(symbols):
+            return False
+        row_id = self.size
+        for column, index, symbol in zip(self.columns, self.index, symbols):
+            column.append(symbol)
+            bucket = index.get(symbol)
+            if bucket is None:
+                index[symbol] = row_id
+            elif type(bucket) is int:
+                index[symbol] = array('i', (bucket, row_id))
+            else:
+                bucket.append(row_id)
+        self.size += 1
+        slots = self.slots
+        if slots is not None:
+            if (self.used + 1) * 4 > len(slots) * 3:
+                self._rehash()
+            else:
+                slots[self._find(symbols) if slot is None else slot] = row_id
+                self.used += 1
+        return True
+
+    # slot of the stored row with these symbol ids, or the EMPTY slot that
+    # ends its probe sequence when there is none (where the row would go)
+    def _find(self, symbols : list[int]):
+        slots, columns = self.slots, self.columns
+        first, head = columns[0], symbols[0]
+        size = len(slots)
+        slot = hash(tuple(symbols)) % size
+        while True:
+            row_id = slots[slot]
+            if row_id == EMPTY:
+                return slot
+            # rows of other chains mostly differ in the first column already
+            if row_id >= 0 and first[row_id] == head:
+                for column, symbol in zip(columns, symbols):
+                    if column[row_id] != symbol:
+                        break
+                else:
+                    return slot
+            slot = (slot + 1) % size
+
+    # slots for every row, half full. Rows are added while at most three
+    # quarters of the slots are used (by rows or DELETED). The old slots are
+    # let go first, so their memory can go into the new ones.
+    def _rehash(self):
+        size = 2 * self.size + 8
+        self.slots = None
+        slots = array('i', [EMPTY]) * size
+        for row_id, code in enumerate(map(hash, zip(*self.columns))):
+            slot = code % size
+            while slots[slot] != EMPTY:
+                slot = (slot + 1) % size
+            slots[slot] = row_id
+        self.slots, self.used = slots, self.size
+
+    # rows holding value (or _) at position
+    def count(self, position : int, value : str):
+        ids, index = self.symbols.ids, self.index[position]
+        total = 0
+        for symbol in (ids.get(value), ids.get(ANY)):
+            bucket = index.get(symbol)
+            if bucket is not None:
+                total += 1 if type(bucket) is int else len(bucket)
+        return total
+
+    # distinct values at position
+    def distinct(self, position : int):
+        return len(self.index[position])
+
+    # add() for many rows, returns the ones that were new
+    def extend(self, rows):
+        return [row for row in rows if self.add(row)]
+
+    # Removes a stored row; the last row takes its place, so the order of the
+    # other rows stays as it was. Returns whether the row was stored.
+    def remove(self, row : tuple):
+        ids = self.symbols.ids
+        symbols = [ids.get(value) for value in row]
+        if len(row) != self.arity or None in symbols:
+            return False
+        slots = self.slots
+        if slots is not None:
+            slot = self._find(symbols)
+            row_id = slots[slot]
+            if row_id == EMPTY:
+                return False
+        else:
+            best = None
+            for index, symbol in zip(self.index, symbols):
+                bucket = index.get(symbol)
+                if bucket is None:
+                    return False
+                if type(bucket) is int:
+                    bucket = (bucket,)
+                if best is None or len(bucket) < len(best):
+                    best = bucket
+            row_id = next((candidate for candidate in best
+                           if all(column[candidate] == symbol for column, symbol in zip(self.columns, symbols))), None)
+            if row_id is None:
+                return False
+        last = self.size - 1
+        if slots is not None:
+            slots[slot] = DELETED
+            if row_id != last:
+                # the last row keeps its slot under its new row id
+                slots[self._find([column[last] for column in self.columns])] = row_id
+        for column, index, symbol in zip(self.columns, self.index, symbols):
+            bucket = index[symbol]
+            if type(bucket) is int:
+                del index[symbol]
+            else:
+                del bucket[bisect.bisect_left(bucket, row_id)]
+                if not bucket:
+                    del index[symbol]
+            moved = column.pop()
+            if row_id != last:
+                column[row_id] = moved
+                bucket = index[moved]
+                if type(bucket) is int:
+                    index[moved] = row_id
+                else:
+                    bucket.pop()
+                    bucket.insert(bisect.bisect_left(bucket, row_id), row_id)
+        self.size -= 1
+        return True
+
+    # rows that can match pattern, where None marks an unbound position.
+    # Only the most selective bound position is scanned, in insertion order,
+    # and only the rows that match are turned into strings.
+    def match(self, pattern : tuple):
+        ids = self.symbols.ids
+        wildcard = ids.get(ANY, -1)
+        best = None
+        bound = []
+        for position, value in enumerate(pattern):
+            if value is None:
+                continue
+            symbol = ids.get(value, -2)
+            index = self.index[position]
+            exact, wild = index.get(symbol, ()), index.get(wildcard, ())
+            if type(exact) is int:
+                exact = (exact,)
+            if type(wild) is int:
+                wild = (wild,)
+            size = len(exact) + len(wild)
+            if size == 0:
+                return
+            bound.append((self.columns[position], symbol))
+            if best is None or size < best[0]:
+                best = (size, exact, wild)
+        if best is None:
+            yield from self
+            return
+        names, columns = self.symbols.names, self.columns
+        candidates = heapq.merge(best[1], best[2]) if best[2] else best[1]
+        for row_id in candidates:
+            for column, symbol in bound:
+                stored = column[row_id]
+                if stored != symbol and stored != wildcard:
+                    break
+            else:
+                yield tuple([names[column[row_id]] for column in columns])
+
+
+class Rule():
+
+    def __init__(self, predicate : str, args : tuple, body : list[tuple[str, tuple]]):
+        self.predicate = predicate
+        self.args = args
+        self.body = body
+        terms = itertools.chain(args, *(goal_args for _, goal_args in body))
+        self.variables = {term for term in terms if is_variable(term) and term != ANY}
+
+    # head arguments and body with variables renamed apart for one use of the rule
+    def rename(self, suffix : int):
+        names = {variable: f'{variable}#{suffix}' for variable in self.variables}
+        args = tuple(names.get(term, term) for term in self.args)
+        body = [(predicate, tuple(names.get(term, term) for term in goal_args)) for predicate, goal_args in self.body]
+        return args, body
+
+    def __repr__(self):
+        body = ', '.join(f'{predicate}({", ".join(args)})' for predicate, args in self.body)
+        return f'{self.predicate}({", ".join(self.args)}) :- {body}'
+
+
+class AnswerCache():
+
+    # least recently used answers keyed by normalized goal; keys are grouped by
+    # predicate so a new clause only drops the goals that can depend on it
+    def __init__(self, size : int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.by_predicate = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key : tuple):
+        answers = self.entries.get(key)
+        if answers is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return answers
+
+    def put(self, key : tuple, answers : list):
+        if self.size <= 0:
+            return
+        self.entries[key] = answers
+        self.entries.move_to_end(key)
+        self.by_predicate.setdefault(key[0], set()).add(key)
+        while len(self.entries) > self.size:
+            old, _ = self.entries.popitem(last=False)
+            keys = self.by_predicate[old[0]]
+            keys.discard(old)
+            if not keys:
+                del self.by_predicate[old[0]]
+
+    def invalidate(self, predicates : set[str]):
+        for predicate in predicates:
+            for key in self.by_predicate.pop(predicate, ()):
+                del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+        self.by_predicate.clear()
+
+
+# goal with its named variables renamed to V0, V1, ... in order of appearance,
+# so "eat(Var, _, meat, _, _)" and "eat(Who, _, meat, _, _)" share an entry
+def normalize(predicate : str, args : tuple):
+    names = {}
+    normalized = []
+    for term in args:
+        if is_variable(term) and term != ANY:
+            term = names.setdefault(term, f'V{len(names)}')
+        normalized.append(term)
+    return (predicate, tuple(normalized)), {variable: name for name, variable in names.items()}
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Table():
+
+    # answers of one tabled call variant; depth is its place on the stack of
+    # tables being evaluated and low the lowest ancestor it consumed from
+    def __init__(self, depth : int):
+        self.depth = depth
+        self.low = depth
+        self.answers = []
+        self.known = set()
+        self.complete = False
+
+    def add(self, row : tuple):
+        if row not in self.known:
+            self.known.add(row)
+            self.answers.append(row)
+
+
+class Search():
+
+    # One resolution over a knowledge base. Goals are proven depth-first;
+    # predicates on a rule cycle are tabled, so every call variant is
+    # evaluated once to its fixpoint and recursive calls consume its answers
+    # instead of looping. Every proven goal is a step: past max_steps or the
+    # timeout (in seconds) the search raises BudgetExceeded. Rows a goal is
+    # matched against are not steps, but the clock is read every ROW_CHECK of
+    # them, so a goal over a large relation stops in time as well.
+    def __init__(self, kb, max_steps : int = None, timeout : float = None):
+        self.kb = kb
+        self.max_steps = max_steps
+        self.deadline = None if timeout is None else time.perf_counter() + timeout
+        self.steps = 0
+        self.rows = 0
+        self.tables = {}
+        self.stack = []
+
+    def _step(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded(f'more than {self.max_steps} steps')
+        if self.deadline is not None and self.steps % 256 == 0 and time.perf_counter() > self.deadline:
+            raise BudgetExceeded('out of time')
+
+    def _row(self):
+        self.rows += 1
+        if self.deadline is not None and self.rows % ROW_CHECK == 0 and time.perf_counter() > self.deadline:
+            raise BudgetExceeded('out of time')
+
+    def solve(self, goals : list[tuple[str, tuple]], subst : dict):
+        if not goals:
+            yield subst
+            return
+        (predicate, args), rest = goals[0], goals[1:]
+        for extended in self.prove(predicate, args, subst):
+            yield from self.solve(rest, extended)
+
+    def prove(self, predicate : str, args : tuple, subst : dict):
+        self._step()
+        args = tuple(walk(term, subst) for term in args)
+
+        if predicate == 'neq':
+            if args[0] != args[1]:
+                yield subst
+            return
+
+        if not self.kb._fixpoint and predicate in self.kb.recursive():
+            for row in self._table(predicate, args):
+                self._row()
+                extended = unify(args, row, subst)
+                if extended is not None:
+                    yield extended
+            return
+
+        yield from self._clauses(predicate, args, subst)
+
+    def _clauses(self, predicate : str, args : tuple, subst : dict):
+        kb = self.kb
+        pattern = tuple(None if is_variable(term) else term for term in args)
+        for relation in kb.relations(predicate):
+            if relation is not None and relation.arity == len(args):
+                for row in relation.match(pattern):
+                    self._row()
+                    extended = unify(args, row, subst)
+                    if extended is not None:
+                        yield extended
+        if kb._fixpoint:
+            return
+
+        mask = None
+        for rule in kb.rules.get(predicate, ()):
+            if len(rule.body) > 1:
+                if mask is None:
+                    mask = tuple(not is_variable(term) for term in args)
+                rule = kb.plan(rule, mask)
+            head, body = rule.rename(next(kb._suffix))
+            extended = unify(args, head, subst)
+            if extended is not None:
+                yield from self.solve(body, extended)
+
+    # answer rows of a call variant. The first call evaluates the clauses
+    # until no new rows appear. A call of a variant that is still being
+    # evaluated (a recursive call) gets the rows found so far, and every table
+    # in between is then incomplete: it is dropped after its own loop and
+    # evaluated again on the next call, once the ancestor has more rows.
+    def _table(self, predicate : str, args : tuple):
+        key, _ = normalize(predicate, args)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = Table(len(self.stack))
+            self.stack.append(table)
+            try:
+                while True:
+                    count = len(table.answers)
+                    for solution in self._clauses(predicate, key[1], {}):
+                        table.add(tuple(ANY if is_variable(term) else term for term in (walk(term, solution) for term in key[1])))
+                    if len(table.answers) == count:
+                        break
+            finally:
+                self.stack.pop()
+            if table.low < table.depth:
+                del self.tables[key]
+            else:
+                table.complete = True
+            return table.answers
+        if not table.complete:
+            for frame in self.stack[table.depth + 1:]:
+                frame.low = min(frame.low, table.depth)
+            return list(table.answers)
+        return table.answers
+
+
+class KnowledgeBase():
+
+    # Ground facts live in one indexed Relation per predicate, rules are kept
+    # per head predicate and resolved depth-first over the relations.
+    # Answers are memoized until a clause they can depend on is added.
+    #
+    # In materialized mode materialize() forward-chains every rule into the
+    # derived relations once, new clauses only propagate their delta, and a
+    # question becomes a lookup in the base and derived relations.
+    #
+    # A question that runs past max_steps or timeout gets the answers found so
+    # far (or none), which are not cached, and last_complete is False.
+    def __init__(self, cache_size : int = 1024, materialized : bool = False,
+                 max_steps : int = 100000, timeout : float = 2.0):
+        self.facts = {}
+        self.rules = {}
+        self.derived = {}
+        self.symbols = Symbols()
+        self.materialized = materialized
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.cache = AnswerCache(cache_size)
+        self._suffix = itertools.count()
+        self._used_by = {}
+        self._affected = {}
+        self._recursive = None
+        self._triggers = {}
+        self._fixpoint = False
+        # bumped by every new clause, lets overlays notice a changed base
+        self.generation = 0
+        # resolution steps of the last query, 0 when it was answered from the
+        # cache and None when the predicate was unknown
+        self.last_steps = None
+        # whether the last query got every answer within max_steps and timeout
+        self.last_complete = True
+        # rules with their body in planned order by (rule, bound head
+        # positions), and the number of facts they were planned for
+        self._plans = {}
+        self._planned_for = 0
+        self._fact_count = 0
+
+    def __call__(self, clauses : list[str]):
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def __len__(self):
+        return sum(len(relation) for relation in self.facts.values()) + sum(len(rules) for rules in self.rules.values())
+
+    def knows(self, predicate : str):
+        return predicate in self.facts or predicate in self.rules
+
+    # fact relations resolution looks up for predicate (None where there is none)
+    def relations(self, predicate : str):
+        return self.facts.get(predicate), self.derived.get(predicate) if self._fixpoint else None
+
+    # parses a prolog clause in pytholog syntax, e.g. "has(E,_,tiger,_,_) :- has(E,_,yellow,_,_)"
+    def add_clause(self, clause : str):
+        import pytholog as pl
+        fact = pl.Fact(clause)
+        body = []
+        for goal in fact.rhs:
+            if not goal.predicate:
+                raise ValueError(f'arithmetic goals are not supported: {clause}')
+            body.append((goal.predicate, tuple(goal.terms)))
+        args = tuple(fact.lh.terms)
+        if body or any(is_variable(term) and term != ANY for term in args):
+            self.add_rule(Rule(fact.lh.predicate, args, body))
+        else:
+            self.add_fact(fact.lh.predicate, args)
+
+    # fact rows by predicate and compiled rules, the input of restore()
+    def dump(self):
+        return ({predicate: relation.rows for predicate, relation in self.facts.items()},
+                [rule for rules in self.rules.values() for rule in rules])
+
+    # dump() in two steps: frozen() copies the columns, which is quick, and
+    # thaw() builds the rows from the copy, which may run on another thread
+    # while this knowledge base moves on (symbol names are only appended to)
+    def frozen(self):
+        return (self.symbols.names,
+                {predicate: [column[:] for column in relation.columns] for predicate, relation in self.facts.items()},
+                [rule for rules in self.rules.values() for rule in rules])
+
+    # loads the rows and compiled rules of a snapshot into an empty knowledge base
+    def restore(self, facts : dict[str, list[tuple]], rules : list[Rule]):
+        for predicate, rows in facts.items():
+            if rows:
+                relation = self.facts[predicate] = Relation(len(rows[0]), self.symbols)
+                for row in rows:
+                    relation.add(row)
+        for rule in rules:
+            self.add_rule(rule)
+        self._fact_count = sum(len(relation) for relation in self.facts.values())
+        self.generation += 1
+        self.cache.clear()
+
+    def add_rule(self, rule : Rule):
+        self.rules.setdefault(rule.predicate, []).append(rule)
+        self._link(rule)
+        self._affected.clear()
+        self._recursive = None
+        self._plans.clear()
+        self.generation += 1
+        if self._fixpoint:
+            self._propagate(self._fire(rule))
+        self.cache.invalidate(self.affected(rule.predicate))
+
+    def _link(self, rule : Rule):
+        for position, (predicate, _) in enumerate(rule.body):
+            self._used_by.setdefault(predicate, set()).add(rule.predicate)
+            if predicate not in BUILTINS:
+                self._triggers.setdefault(predicate, []).append((rule, position))
+
+    def add_fact(self, predicate : str, args : tuple):
+        relation = self.facts.get(predicate)
+        if relation is None:
+            relation = self.facts[predicate] = Relation(len(args), self.symbols)
+        added = relation.add(args)
+        if added:
+            self._fact_count += 1
+            self.generation += 1
+            if self._fixpoint:
+                self._propagate({predicate: [args]})
+            self.cache.invalidate(self.affected(predicate))
+        return added
+
+    def remove_rule(self, rule : Rule):
+        return self.remove_clauses([rule], []) == 1
+
+    def remove_fact(self, predicate : str, args : tuple):
+        return self.remove_clauses([], [(predicate, args)]) == 1
+
+    # Removes rules (matched by head and body) and (predicate, args) facts in
+    # one go, returns how many of them were there. Answers that can depend on
+    # them are dropped from the cache. In materialized mode the derived rows
+    # are kept up to date by delete and rederive: every derived row with a
+    # derivation that used a removed clause is deleted, the ones that are
+    # still derivable without it are derived again and propagated, so the
+    # work grows with the rows the removal touches, not with the fixpoint.
+    def remove_clauses(self, rules : list[Rule], facts : list[tuple[str, tuple]]):
+        removed_rules = []
+        for rule in rules:
+            known = next((known for known in self.rules.get(rule.predicate, ())
+                          if known.args == rule.args and known.body == rule.body and known not in removed_rules), None)
+            if known is not None:
+                removed_rules.append(known)
+        removed_facts = {}
+        for predicate, args in facts:
+            relation = self.facts.get(predicate)
+            if relation is not None and args in relation and args not in removed_facts.get(predicate, ()):
+                removed_facts.setdefault(predicate, []).append(args)
+        if not removed_rules and not removed_facts:
+            return 0
+        affected = set().union(*(self.affected(predicate) for predicate in
+                                 itertools.chain((rule.predicate for rule in removed_rules), removed_facts)))
+        deleted = self._overdelete(removed_rules, removed_facts) if self._fixpoint else {}
+
+        for predicate, rows in removed_facts.items():
+            relation = self.facts[predicate]
+            for args in rows:
+                relation.remove(args)
+            self._fact_count -= len(rows)
+        for rule in removed_rules:
+            known = self.rules[rule.predicate]
+            known.remove(rule)
+            if not known:
+                del self.rules[rule.predicate]
+        if removed_rules:
+            self._used_by.clear()
+            self._triggers.clear()
+            for known in self.rules.values():
+                for rule in known:
+                    self._link(rule)
+            self._affected.clear()
+            self._recursive = None
+            self._plans.clear()
+        if self._fixpoint:
+            for predicate, rows in deleted.items():
+                relation = self.derived[predicate]
+                for row in rows:
+                    relation.remove(row)
+            # a removed fact may still follow from the rules
+            for predicate, rows in removed_facts.items():
+                if predicate in self.rules:
+                    deleted.setdefault(predicate, []).extend(rows)
+            self._propagate(self._rederive(deleted))
+        self.generation += 1
+        self.cache.invalidate(affected)
+        return len(removed_rules) + sum(len(rows) for rows in removed_facts.values())
+
+    # derived rows with a derivation that uses a removed rule or fact, found
+    # while they are all still in place
+    def _overdelete(self, rules : list[Rule], facts : dict[str, list[tuple]]):
+        deleted = {}
+
+        def delete(predicate, rows, into):
+            relation = self.derived.get(predicate)
+            known = deleted.setdefault(predicate, set())
+            for row in rows:
+                if relation is not None and row not in known and row in relation:
+                    known.add(row)
+                    into.setdefault(predicate, []).append(row)
+
+        delta = {predicate: list(rows) for predicate, rows in facts.items()}
+        for rule in rules:
+            delete(rule.predicate, self._derive(rule), delta)
+        while delta:
+            new = {}
+            for predicate, rows in delta.items():
+                for rule, position in self._triggers.get(predicate, ()):
+                    for row in rows:
+                        delete(rule.predicate, self._derive(rule, position, row), new)
+            delta = new
+        return {predicate: list(rows) for predicate, rows in deleted.items() if rows}
+
+    # the deleted rows that one rule still derives from the rows left, added
+    # back; everything that follows from them is left to _propagate
+    def _rederive(self, deleted : dict[str, list[tuple]]):
+        delta = {}
+        for predicate, rows in deleted.items():
+            for row in rows:
+                for rule in self.rules.get(predicate, ()):
+                    if row in self._derive(rule, head=row) and self._add_derived(predicate, row):
+                        delta.setdefault(predicate, []).append(row)
+                        break
+        return delta
+
+    # adds (predicate, args) facts in one go: the answer cache is invalidated
+    # once per predicate and in materialized mode the rules are propagated
+    # once for all of them. Returns the new rows by predicate.
+    def add_facts(self, facts):
+        grouped = {}
+        for predicate, args in facts:
+            rows = grouped.get(predicate)
+            if rows is None:
+                rows = grouped[predicate] = []
+            rows.append(args)
+        delta = {}
+        for predicate, rows in grouped.items():
+            relation = self.facts.get(predicate)
+            if relation is None:
+                relation = self.facts[predicate] = Relation(len(rows[0]), self.symbols)
+            new = relation.extend(rows)
+            if new:
+                delta[predicate] = new
+        if delta:
+            self._fact_count += sum(len(rows) for rows in delta.values())
+            self.generation += 1
+            if self._fixpoint:
+                self._propagate({predicate: list(rows) for predicate, rows in delta.items()})
+            for predicate in delta:
+                self.cache.invalidate(self.affected(predicate))
+        return delta
+
+    # Query planning. A goal is expected to match the rows of its relation
+    # that hold each of its constants (counted in the indexes), divided by
+    # the distinct values of every position a variable bound by an earlier
+    # goal takes; a predicate with rules is expected to derive as many rows
+    # again per rule. Between built-ins, which keep their written place, the
+    # goals of a body are proven most selective first when that is estimated
+    # to pay (PLAN_GAIN). Plans are kept per rule and bound head positions
+    # until a rule is added or the number of facts halves or doubles.
+    def estimate(self, predicate : str, args : tuple, bound : set[str]):
+        relation = self.facts.get(predicate)
+        rows = float(len(relation)) if relation is not None else 0.0
+        if rows:
+            size = rows
+            for position, term in enumerate(args):
+                if term == ANY:
+                    continue
+                if is_variable(term):
+                    if term in bound:
+                        rows /= max(1, relation.distinct(position))
+                else:
+                    rows *= relation.count(position, term) / size
+        rules = self.rules.get(predicate)
+        if rules:
+            rows += len(rules) * max(1.0, rows)
+        return rows
+
+    # rows tried when goals are proven in this order
+    def _cost(self, goals : list[tuple[str, tuple]], bound : set[str]):
+        bound = set(bound)
+        cost, rows = 0.0, 1.0
+        for predicate, args in goals:
+            if predicate not in BUILTINS:
+                rows *= self.estimate(predicate, args, bound)
+                cost += rows
+            bound.update(term for term in args if is_variable(term))
+        return cost
+
+    def plan(self, rule : Rule, mask : tuple[bool]):
+        if not self._planned_for / 2 <= self._fact_count <= self._planned_for * 2:
+            self._plans.clear()
+            self._planned_for = self._fact_count
+        planned = self._plans.get((rule, mask))
+        if planned is None:
+            planned = self._plans[(rule, mask)] = self._order(rule, mask)
+        return planned
+
+    def _order(self, rule : Rule, mask : tuple[bool]):
+        bound = {term for term, known in zip(rule.args, mask) if known and is_variable(term) and term != ANY}
+        variables = set(bound)
+        ordered, segment = [], []
+        for goal in rule.body + [None]:
+            if goal is not None and goal[0] not in BUILTINS:
+                segment.append(goal)
+                continue
+            while segment:
+                best = min(segment, key=lambda goal: self.estimate(goal[0], goal[1], variables))
+                segment.remove(best)
+                ordered.append(best)
+                variables.update(term for term in best[1] if is_variable(term))
+            if goal is not None:
+                ordered.append(goal)
+                variables.update(term for term in goal[1] if is_variable(term))
+        if ordered == rule.body or self._cost(ordered, bound) * PLAN_GAIN > self._cost(rule.body, bound):
+            return rule
+        return Rule(rule.predicate, rule.args, ordered)
+
+    # predicates whose answers can change when a clause for predicate is added:
+    # itself and every rule head that reaches it through rule bodies
+    def affected(self, predicate : str):
+        result = self._affected.get(predicate)
+        if result is None:
+            result = {predicate}
+            pending = [predicate]
+            while pending:
+                for head in self._used_by.get(pending.pop(), ()):
+                    if head not in result:
+                        result.add(head)
+                        pending.append(head)
+            self._affected[predicate] = result
+        return result
+
+    # predicates that reach themselves through rule bodies
+    def recursive(self):
+        if self._recursive is None:
+            self._recursive = {predicate for predicate, heads in self._used_by.items()
+                               if any(predicate in self.affected(head) for head in heads)}
+        return self._recursive
+
+    # computes the fixpoint of all derivable facts with semi-naive evaluation
+    def materialize(self):
+        if not self.materialized or self._fixpoint:
+            return
+        self._fixpoint = True
+        delta = {predicate: list(relation.rows) for predicate, relation in self.facts.items()}
+        for rules in self.rules.values():
+            for rule in rules:
+                if not rule.body:
+                    for predicate, rows in self._fire(rule).items():
+                        delta.setdefault(predicate, []).extend(rows)
+        self._propagate(delta)
+        self.cache.clear()
+
+    def _add_derived(self, predicate : str, row : tuple):
+        base = self.facts.get(predicate)
+        if base is not None and row in base:
+            return False
+        relation = self.derived.get(predicate)
+        if relation is None:
+            relation = self.derived[predicate] = Relation(len(row), self.symbols)
+        return relation.add(row)
+
+    # head of rule for every solution of its body (or of the body with the goal
+    # at position bound to row); variables left unbound become _. Returns the
+    # rows that were not known before, by predicate.
+    def _fire(self, rule : Rule, position : int = None, row : tuple = None):
+        new = [derived for derived in self._derive(rule, position, row) if self._add_derived(rule.predicate, derived)]
+        return {rule.predicate: new} if new else {}
+
+    # the rows rule derives, with the body goal at position bound to row or
+    # with the head bound to head
+    def _derive(self, rule : Rule, position : int = None, row : tuple = None, head : tuple = None):
+        pattern, values = (rule.body[position][1], row) if position is not None else (rule.args, head)
+        if values is not None:
+            # a constant the row does not hold: no need to rename the rule
+            for term, value in zip(pattern, values):
+                if term != value and value != ANY and not is_variable(term):
+                    return []
+        args, body = rule.rename(next(self._suffix))
+        subst = {}
+        if position is not None:
+            subst = unify(body[position][1], row, subst)
+            body = body[:position] + body[position + 1:]
+        elif head is not None:
+            subst = unify(args, head, subst)
+        if subst is None:
+            return []
+        return [tuple(ANY if is_variable(term) else term for term in (walk(term, solution) for term in args))
+                for solution in Search(self).solve(body, subst)]
+
+    # semi-naive step: only rules with a body goal that matches a new row are
+    # fired, with that goal bound to the row and the rest joined against the
+    # relations, until a round derives nothing new
+    def _propagate(self, delta : dict[str, list[tuple]]):
+        while delta:
+            new = {}
+            for predicate, rows in delta.items():
+                for rule, position in self._triggers.get(predicate, ()):
+                    for row in rows:
+                        for head, derived in self._fire(rule, position, row).items():
+                            new.setdefault(head, []).extend(derived)
+            delta = new
+
+    def solve(self, predicate : str, args : tuple, subst : dict = None):
+        return Search(self, self.max_steps, self.timeout).solve([(predicate, args)], subst or {})
+
+    # answers in the shape pytholog returns them: a dict of bindings per
+    # distinct solution, "Yes" for a solution that binds nothing, ["No"] when
+    # there is no solution and [] when the predicate is unknown.
+    #
+    # With a limit resolution stops once limit answers that bind the
+    # variables are found (the first solution when the goal has none), and
+    # the result is the first limit answers of the full one. Cut short
+    # answers are cached apart from complete ones.
+    def query(self, predicate : str, args : tuple, limit : int = None):
+        if not self.knows(predicate):
+            self.last_steps = None
+            self.last_complete = True
+            return []
+        key, names = normalize(predicate, args)
+        answers = self.cache.get(key)
+        if answers is None and limit is not None:
+            answers = self.cache.get(key + (limit,))
+        self.last_steps = 0
+        self.last_complete = True
+        if answers is None:
+            answers, complete, exhausted = self._answer(*key, limit)
+            self.last_complete = complete
+            if complete:
+                self.cache.put(key if exhausted else key + (limit,), answers)
+        elif limit is not None:
+            answers = answers[:limit]
+        return [{names[name]: value for name, value in answer.items()} if isinstance(answer, dict) else answer
+                for answer in answers]
+
+    # distinct answers of a goal, lazily, in the order resolution finds them:
+    # a dict of the values bound to its named variables or "Yes" when none is bound
+    def answers(self, predicate : str, args : tuple, search : Search = None):
+        names = list(dict.fromkeys(term for term in args if is_variable(term) and term != ANY))
+        seen = set()
+        search = search if search is not None else Search(self, self.max_steps, self.timeout)
+        for subst in search.solve([(predicate, args)], {}):
+            answer = {}
+            for name in names:
+                value = walk(name, subst)
+                if not is_variable(value):
+                    answer[name] = value
+            key = tuple(answer.items())
+            if key not in seen:
+                seen.add(key)
+                yield answer or 'Yes'
+
+    # (answers, complete: within the budget, exhausted: not cut short by limit)
+    def _answer(self, predicate : str, args : tuple, limit : int = None):
+        binds = any(is_variable(term) and term != ANY for term in args)
+        answers = []
+        found = 0
+        complete = exhausted = True
+        search = Search(self, self.max_steps, self.timeout)
+        try:
+            for answer in self.answers(predicate, args, search):
+                answers.append(answer)
+                if limit is not None and (answer != 'Yes' or not binds):
+                    found += 1
+                    if found >= limit:
+                        exhausted = False
+                        break
+        except (BudgetExceeded, RecursionError):
+            complete = False
+        self.last_steps = search.steps
+        if not answers:
+            return ([] if not complete else ['No']), complete, exhausted
+        if any(isinstance(answer, dict) for answer in answers):
+            answers = [answer for answer in answers if answer != 'Yes']
+        return answers, complete, exhausted
+
+
+class Overlay(KnowledgeBase):
+
+    # The facts of one session on top of a shared base knowledge base. The
+    # base is only read: its rules and facts are used in place, new facts go
+    # into the overlay's own relations, so an overlay costs memory in
+    # proportion to its own facts. Questions that none of the overlay's facts
+    # can change are answered (and cached) by the base. The rest are resolved
+    # backward over base and overlay facts, also when the base is
+    # materialized, and cached per overlay until the base changes.
+    def __init__(self, base : KnowledgeBase, cache_size : int = 64):
+        super().__init__(cache_size, False, base.max_steps, base.timeout)
+        self.base = base
+        self.rules = base.rules
+        self._suffix = base._suffix
+        self._seen = base.generation
+        # predicates whose answers the overlay's facts can change
+        self.dirty = set()
+        # facts the session stated while the base held them; one the base
+        # drops becomes the overlay's own
+        self.stated = set()
+
+    def __len__(self):
+        return sum(len(relation) for relation in self.facts.values())
+
+    def knows(self, predicate : str):
+        return predicate in self.facts or self.base.knows(predicate)
+
+    def relations(self, predicate : str):
+        return self.base.facts.get(predicate), self.facts.get(predicate)
+
+    def affected(self, predicate : str):
+        return self.base.affected(predicate)
+
+    def plan(self, rule : Rule, mask : tuple[bool]):
+        return self.base.plan(rule, mask)
+
+    def recursive(self):
+        return self.base.recursive()
+
+    def add_rule(self, rule : Rule):
+        raise TypeError('rules belong to the base knowledge base, an overlay only holds facts')
+
+    def remove_clauses(self, rules : list[Rule], facts : list[tuple[str, tuple]]):
+        if rules:
+            raise TypeError('rules belong to the base knowledge base, an overlay only holds facts')
+        return super().remove_clauses(rules, facts)
+
+    def add_fact(self, predicate : str, args : tuple):
+        base = self.base.facts.get(predicate)
+        if base is not None and args in base:
+            self.stated.add((predicate, args))
+            return False
+        relation = self.facts.get(predicate)
+        if relation is None:
+            relation = self.facts[predicate] = Relation(len(args), self.symbols)
+        added = relation.add(args)
+        if added:
+            self.generation += 1
+            affected = self.affected(predicate)
+            self.dirty |= affected
+            self.cache.invalidate(affected)
+        return added
+
+    def add_facts(self, facts):
+        delta = {}
+        for predicate, args in facts:
+            if self.add_fact(predicate, args):
+                delta.setdefault(predicate, []).append(args)
+        return delta
+
+    def query(self, predicate : str, args : tuple, limit : int = None):
+        if self._seen != self.base.generation:
+            self._seen = self.base.generation
+            for fact in [fact for fact in self.stated if fact[1] not in self.base.facts.get(fact[0], ())]:
+                self.stated.discard(fact)
+                self.add_fact(*fact)
+            self.cache.clear()
+            self.dirty = set().union(*(self.affected(predicate) for predicate in self.facts))
+        if predicate not in self.dirty:
+            answers = self.base.query(predicate, args, limit)
+            self.last_steps, self.last_complete = self.base.last_steps, self.base.last_complete
+            return answers
+        return super().query(predicate, args, limit)
+
+
+# the facts (string rows by predicate) and rules of a KnowledgeBase.frozen()
+# copy, in the shape dump() returns
+def thaw(frozen : tuple):
+    names, columns, rules = frozen
+    return ({predicate: [tuple([names[symbol] for symbol in row]) for row in zip(*relation)]
+             for predicate, relation in columns.items()}, rules)
+
+
+# facts and rules of a list of clause strings, ready for KnowledgeBase.restore
+def compile_clauses(clauses : list[str]):
+    kb = KnowledgeBase(cache_size=0)
+    kb(clauses)
+    return kb.dump()
@@ -0,0 +1,119 @@
+import sys
+import json
+import threading
+from collections import Counter, deque
+
+# samples kept per timer and per distribution, and of the latencies of the
+# server (see server.LuxServer)
+WINDOW = 10000
+
+
+def summary(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'count': len(ordered), 'mean': sum(ordered) / len(ordered),
+            'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': ordered[-1]}
+
+
+class Metrics():
+
+    # In-process registry for the instrumentation of Lux.think: timers (in
+    # microseconds), distributions, counters and gauges by name, the parser
+    # forms that matched, and the stacks of the sampling profiler. Lux only
+    # records when it has a registry (lux.metrics), so without one the cost is
+    # a few attribute tests per query.
+    def __init__(self, window : int = WINDOW):
+        self.window = window
+        self.timers = {}
+        self.distributions = {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.forms = Counter()
+        self.stacks = Counter()
+        self._sampler = None
+        self._sampling = None
+
+    def time(self, name : str, seconds : float):
+        samples = self.timers.get(name)
+        if samples is None:
+            samples = self.timers[name] = deque(maxlen=self.window)
+        samples.append(seconds * 1e6)
+
+    def observe(self, name : str, value : float):
+        samples = self.distributions.get(name)
+        if samples is None:
+            samples = self.distributions[name] = deque(maxlen=self.window)
+        samples.append(value)
+
+    def count(self, name : str, value : int = 1):
+        self.counters[name] += value
+
+    def gauge(self, name : str, value):
+        self.gauges[name] = value
+
+    def reset(self):
+        self.timers.clear()
+        self.distributions.clear()
+        self.counters.clear()
+        self.gauges.clear()
+        self.forms.clear()
+        self.stacks.clear()
+
+    def snapshot(self):
+        hits, misses = self.counters['cache.hits'], self.counters['cache.misses']
+        return {
+            'timers_us': {name: summary(samples) for name, samples in self.timers.items()},
+            'distributions': {name: summary(samples) for name, samples in self.distributions.items()},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'cache_hit_rate': hits / (hits + misses) if hits + misses else None,
+            'parser_forms': dict(self.forms.most_common()),
+            'profile_samples': sum(self.stacks.values()),
+        }
+
+    def export(self, path : str):
+        with open(path, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    # Sampling profiler: a daemon thread looks at the stack of thread (the
+    # caller by default) every interval seconds and counts it. on_sample, when
+    # given, is called with every sampled stack (a tuple of "file:function",
+    # outermost first) instead of counting it here.
+    def start_profiler(self, interval : float = 0.005, thread : threading.Thread = None, on_sample = None):
+        self.stop_profiler()
+        target = (thread or threading.current_thread()).ident
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(interval):
+                frame = sys._current_frames().get(target)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}')
+                    frame = frame.f_back
+                stack = tuple(reversed(stack))
+                if on_sample is not None:
+                    on_sample(stack)
+                else:
+                    self.stacks[stack] += 1
+
+        self._sampling = stop
+        self._sampler = threading.Thread(target=sample, name='lux-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop_profiler(self):
+        if self._sampler is not None:
+            self._sampling.set()
+            self._sampler.join()
+            self._sampler = self._sampling = None
+
+    # profile in the collapsed format flame graph tools read: "a;b;c count"
+    def export_profile(self, path : str):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{";".join(stack)} {count}\n')
@@ -0,0 +1,117 @@
+import gc
+import multiprocessing as mp
+from Lux import Lux, SentenceType
+
+# Lux a forked worker inherited from the parent, and how many of the
+# parent's statements it has replayed since the fork
+_snapshot = None
+_version = 0
+
+
+# runs in a worker when it starts: the journal belongs to the parent, a
+# worker replaying statements must not write them (or snapshots) again
+def _detach():
+    _snapshot.processor.journal = None
+
+
+# runs in a worker: catch up with the statements the parent made up to
+# version, then answer the questions
+def _answer(task : tuple):
+    global _version
+    version, statements, questions = task
+    for preprocessed in statements[_version:version]:
+        _snapshot._think(preprocessed)
+    _version = version
+    return [_snapshot._think(preprocessed) for preprocessed in questions]
+
+
+class LuxPool():
+
+    # Answers questions on a pool of forked processes. The workers share the
+    # parent's Lux as a copy-on-write snapshot taken at fork time. Statements
+    # only run in the parent; every task carries the statements made since the
+    # snapshot and the version it must see, and workers replay what they miss.
+    # Past max_deltas statements the pool is forked again from a new snapshot,
+    # and so it is after a reload (see Lux.schedule_reload), which think_many
+    # applies before the next query as Lux.think_many does.
+    def __init__(self, lux : Lux, workers : int = None, max_deltas : int = 1024,
+                 batch_size : int = 4096, chunks_per_worker : int = 4):
+        self.lux = lux
+        self.workers = workers or mp.cpu_count()
+        self.max_deltas = max_deltas
+        self.batch_size = batch_size
+        self.chunks_per_worker = chunks_per_worker
+        self.statements = []
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _fork(self):
+        global _snapshot, _version
+        self.close()
+        self.statements = []
+        _snapshot, _version = self.lux, 0
+        # keep the collector away from the shared objects so their pages stay shared
+        gc.collect()
+        gc.freeze()
+        try:
+            self._pool = mp.get_context('fork').Pool(self.workers, initializer=_detach)
+        finally:
+            gc.unfreeze()
+
+    # answers a run of questions that no statement separates, in order
+    def _answer_run(self, questions : list[str]):
+        if self._pool is None:
+            self._fork()
+        unique = list(dict.fromkeys(questions))
+        size = max(1, -(-len(unique) // (self.workers * self.chunks_per_worker)))
+        version = len(self.statements)
+        tasks = [(version, self.statements, unique[i:i + size]) for i in range(0, len(unique), size)]
+        replies = {}
+        for chunk, answers in zip(tasks, self._pool.map(_answer, tasks)):
+            replies.update(zip(chunk[2], answers))
+        return [replies[preprocessed] for preprocessed in questions]
+
+    # same contract as Lux.think_many: one reply per query, in input order,
+    # every question answered against the statements made before it
+    def think_many(self, queries):
+        if 'fork' not in mp.get_all_start_methods():
+            yield from self.lux.think_many(queries)
+            return
+        lux = self.lux
+        questions = []
+        for query in queries:
+            if lux.pending is not None:
+                # the questions so far came before the reload
+                if questions:
+                    yield from self._answer_run(questions)
+                    questions = []
+                if lux._apply_pending() is not None:
+                    self.close()
+            preprocessed = lux.lexer.preprocess(query)
+            if preprocessed == "hi" or preprocessed == "hello" or lux.parser.parse(preprocessed).stype != SentenceType.Statement:
+                questions.append(preprocessed)
+                if len(questions) >= self.batch_size:
+                    yield from self._answer_run(questions)
+                    questions = []
+                continue
+            if questions:
+                yield from self._answer_run(questions)
+                questions = []
+            yield lux._think(preprocessed)
+            if self._pool is not None:
+                self.statements.append(preprocessed)
+                if len(self.statements) > self.max_deltas:
+                    self.close()
+        if questions:
+            yield from self._answer_run(questions)
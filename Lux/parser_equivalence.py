@@ -0,0 +1,182 @@
+# Equivalence harness for Parser: compares the single-pass grammar engine with
+# the regex cascade it replaced on a generated corpus of lexer-shaped queries.
+#
+#   python parser_equivalence.py [--count 200000] [--seed 0] [--length 9]
+
+import re
+import os
+import random
+import argparse
+import itertools
+import yaml
+from Lux import Lexer, Parser, Sentence, SentenceType
+
+VOCABULARY = [
+    'which', 'who', 'what', 'when', 'where', 'of', 'in', 'at', 'is', '?',
+    'dog', 'user', 'eat', 'apples', 'night', 'home', 'has', 'study', 'inna',
+    'intelligent_systems', '4160', 'hello', "it's", 'apples?', 'x-y', '?!', '',
+]
+
+# Every form from the comments of the regex cascade, as typed by a user
+EXAMPLES = [
+    "Which Dog eat apples at night?", "Which Dog eat at night?", "Which Dog eat apples?", "Which Dog eat?",
+    "Who eat at night?", "Who eat apples at night?", "Who eat apples?", "Who eat?",
+    "What Dog of user eat at night?", "What dog of user eat?", "What Dog eat at night?", "What Dog eat?",
+    "When Dog of user eat apples?", "When dog of user eat?", "When Dog eat the apples?", "When Dog eat?",
+    "Where Dog of user eat apples?", "Where dog of user eat?", "Where Dog eat the apples?", "Where Dog eat?",
+    "dog of user eat apples at night", "dog of user eat apples at night?",
+    "Dog of user eat at night", "Dog of user eat at night?",
+    "dog eat apples at night", "dog eat apples at night?",
+    "Dog eat at night", "Dog eat at night?",
+    "Dog of user eat apples", "Dog of user eat apples?",
+    "Dog of user eat", "Dog of user eat?",
+    "Dog eat apples", "Dog eat apples?",
+    "Dog eat", "Dog eat?",
+    "my dog eat apples at night", "is tiger carnivore?", "who study intelligent systems?",
+    "where inna study intelligent systems?", "tell me which dog eat apples", "hello, who is tiger?",
+]
+
+
+class RegexParser():
+
+    def parse(self, query : str):
+        sen_type = SentenceType.Statement
+        question = subject = belong = rule_name = value = addition_prefix = addition = None
+
+        #matches "Which Dog eat apples at night?"
+        if match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name, value, addition_prefix, addition = match.groups()
+        #matches "Which Dog eat at night?"
+        elif match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name, addition_prefix, addition = match.groups()
+        #matches "Which Dog eat apples?"
+        elif match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name, value = match.groups()
+        #matches "Which Dog eat?"
+        elif match := re.search(r'(?:.* |^)(which) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name = match.groups()
+
+        #matches "Who eat at night?"
+        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
+            question, rule_name, addition_prefix, addition = match.groups()
+        #matches "Who eat apples at night?"
+        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
+            question, rule_name, value, addition_prefix, addition = match.groups()
+        #matches "Who eat apples?"
+        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, rule_name, value = match.groups()
+        #matches "Who eat?"
+        elif match := re.search(r'(?:.* |^)(who) ([a-zA-Z0-9_]+)', query):
+            question, rule_name = match.groups()
+
+        #matches "What Dog of user eat at night?"
+        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
+            question, subject, belong, rule_name, addition_prefix, addition = match.groups()
+        #matches "What dog of user eat?"
+        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, belong, rule_name = match.groups()
+        #matches "What Dog eat at night?"
+        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name, addition_prefix, addition = match.groups()
+        #matches "What Dog eat?"
+        elif match := re.search(r'(?:.* |^)(what) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name = match.groups()
+
+        #matches "When Dog of user eat apples?"
+        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, belong, rule_name, value = match.groups()
+        #matches "When dog of user eat?"
+        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, belong, rule_name = match.groups()
+        #matches "When Dog eat the apples?"
+        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name, value = match.groups()
+        #matches "When Dog eat?"
+        elif match := re.search(r'(?:.* |^)(when|where) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+)', query):
+            question, subject, rule_name = match.groups()
+
+        #matches "dog of user eat apples at night" or "dog of user eat apples at night?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, belong, rule_name, value, addition_prefix, addition, question = match.groups()
+        #matches "Dog of user eat at night" or "Dog of user eat at night?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, belong, rule_name, addition_prefix, addition, question = match.groups()
+        #matches "dog eat apples at night" or "dog eat apples at night?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, rule_name, value, addition_prefix, addition, question = match.groups()
+        #matches "Dog eat at night" or "Dog eat at night?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) (in|at) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, rule_name, addition_prefix, addition, question = match.groups()
+        #matches "Dog of user eat apples" or "Dog of user eat apples?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, belong, rule_name, value, question = match.groups()
+        #matches "Dog of user eat" or "Dog of user eat?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) of ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, belong, rule_name, question = match.groups()
+        #matches "Dog eat apples" or "Dog eat apples?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, rule_name, value, question = match.groups()
+        #matches "Dog eat" or "Dog eat?"
+        elif match := re.search(r'(?:.* |^)([a-zA-Z0-9_]+) ([a-zA-Z0-9_]+) ?(\?)?', query):
+            subject, rule_name, question = match.groups()
+        
+        rule_name = 'has' if rule_name == 'is' else rule_name
+
+        match question:
+            case 'when':
+                question = SentenceType.WhenQuestion
+            case 'where':
+                question = SentenceType.WhereQuestion
+            case 'what':
+                question = SentenceType.WhatQuestion
+            case 'who':
+                question = SentenceType.WhoQuestion
+            case 'which':
+                question = SentenceType.WhichQuestion
+            case '?':
+                question = SentenceType.Question
+
+        sen_type = question if question != None and type(question) is SentenceType else sen_type
+        
+        return Sentence(sen_type, subject, belong, rule_name, value, addition_prefix, addition)
+
+
+def corpus(count : int, seed : int, length : int):
+    datafile = os.path.dirname(os.path.abspath(__file__)) + '/data.yaml'
+    with open(datafile, 'r') as file:
+        data = yaml.safe_load(file)
+    lexer = Lexer(data['synonyms'], data['concats'])
+    for example in EXAMPLES:
+        yield lexer.preprocess(example)
+
+    # every short sentence over the vocabulary, then random longer ones
+    for size in range(1, 4):
+        for words in itertools.product(VOCABULARY, repeat=size):
+            yield ' '.join(words)
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield ' '.join(rng.choices(VOCABULARY, k=rng.randint(1, length)))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare Parser with the old regex cascade')
+    argparser.add_argument('--count', type=int, default=200000, help='number of random queries')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--length', type=int, default=9, help='maximum random query length in tokens')
+    args = argparser.parse_args()
+
+    reference, parser = RegexParser(), Parser()
+    checked = mismatches = 0
+    for query in corpus(args.count, args.seed, args.length):
+        expected, actual = reference.parse(query), parser.parse(query)
+        checked += 1
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 20:
+                print(f'MISMATCH {query!r}\n  regex:   {expected}\n  grammar: {actual}')
+    print(f'{checked} queries checked, {mismatches} mismatches')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,306 @@
+# Network front end for Lux.
+#
+#   python server.py serve [--port 7007] [--unix PATH] [--http-port 7008] [--max-in-flight 64] [--watch [SECONDS]]
+#   python server.py load [--port 7007] [--unix PATH] [--connections 16] [--requests 2000] [--pipeline 4]
+#
+# The line protocol takes one JSON object per line, {"id": 1, "query": "who is tiger?"},
+# and answers {"id": 1, "reply": "Tiger has tiger.", "latency_ms": 0.4}.
+# A request with "session": "..." learns and answers in that session's own
+# knowledge base overlay (see sessions.SessionStore) instead of the shared one.
+# The HTTP endpoint answers GET /think?q=...&session=..., POST /think with the
+# same JSON body, and GET /stats.
+# With --watch, edits to the data file are hot reloaded (see watcher.DataWatcher).
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import functools
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from Lux import Lux
+from sessions import SessionStore
+from metrics import Metrics, WINDOW, summary
+from watcher import DataWatcher
+
+DATAFILE = os.path.dirname(os.path.abspath(__file__)) + '/data.yaml'
+
+# seconds between sweeps for idle sessions
+SWEEP_INTERVAL = 60.0
+
+# longest request line and longest HTTP request body, in bytes
+MAX_REQUEST = 64 * 1024
+
+
+# next line of reader, b'' at the end of the stream; a line longer than the
+# limit of reader (MAX_REQUEST) is skipped and read as None
+async def readline(reader : asyncio.StreamReader):
+    overlong = False
+    while True:
+        try:
+            line = await reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as error:
+            line = error.partial
+        except asyncio.LimitOverrunError as error:
+            overlong = True
+            await reader.readexactly(error.consumed)
+            continue
+        return None if overlong else line
+
+
+class TooLarge(Exception):
+    pass
+
+
+class LuxServer():
+
+    # Serves Lux.think to many connections from one event loop. Lux is not
+    # thread safe, so replies are computed on a single executor thread, which
+    # keeps the loop free for I/O. At most max_in_flight requests are admitted;
+    # after that no more requests are read, and TCP pushes back on clients.
+    def __init__(self, lux : Lux, max_in_flight : int = 64, sessions : SessionStore = None,
+                 watcher : DataWatcher = None):
+        self.lux = lux
+        self.sessions = sessions if sessions is not None else SessionStore(lux)
+        self.watcher = watcher
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lux')
+        self.in_flight = 0
+        self.served = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=WINDOW)
+        self._slots = None
+
+    async def think(self, query : str, session : str = None):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        async with self._slots:
+            return await self._think(query, session)
+
+    async def _think(self, query : str, session : str = None):
+        self.in_flight += 1
+        start = time.perf_counter()
+        if session is None:
+            work = functools.partial(self.lux.think, query)
+        else:
+            work = functools.partial(self.sessions.think, str(session), query)
+        try:
+            reply = await asyncio.get_running_loop().run_in_executor(self.executor, work)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        latency = (time.perf_counter() - start) * 1e3
+        self.served += 1
+        self.latencies.append(latency)
+        return reply, latency
+
+    def stats(self):
+        return {'served': self.served, 'errors': self.errors, 'in_flight': self.in_flight,
+                'latency_ms': summary(self.latencies), 'sessions': self.sessions.stats(),
+                'reloads': self.watcher.stats() if self.watcher is not None else None,
+                'metrics': self.lux.metrics.snapshot() if self.lux.metrics is not None else None}
+
+    # sessions live on the executor thread like everything else of Lux
+    async def _sweep(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            await loop.run_in_executor(self.executor, self.sessions.evict_idle)
+
+    async def _respond(self, request : dict, writer : asyncio.StreamWriter):
+        response = {'id': request.get('id')}
+        try:
+            response['reply'], response['latency_ms'] = await self._think(str(request['query']), request.get('session'))
+        except Exception as error:
+            response['error'] = f'{type(error).__name__}: {error}'
+        finally:
+            self._slots.release()
+        writer.write((json.dumps(response) + '\n').encode())
+        await writer.drain()
+
+    # line protocol: requests of one connection may be pipelined, every
+    # response carries the id of its request
+    async def handle_lines(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        try:
+            while (line := await readline(reader)) != b'':
+                try:
+                    if line is None:
+                        raise ValueError(f'request longer than {MAX_REQUEST} bytes')
+                    request = json.loads(line)
+                    if not isinstance(request, dict) or 'query' not in request:
+                        raise ValueError('expected {"id": ..., "query": ...}')
+                except ValueError as error:
+                    writer.write((json.dumps({'error': str(error)}) + '\n').encode())
+                    await writer.drain()
+                    continue
+                # the next line is not read until a slot frees up
+                await self._slots.acquire()
+                task = asyncio.create_task(self._respond(request, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # minimal HTTP/1.1, one request per connection
+    async def handle_http(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := (await reader.readline()).decode('latin-1').strip()):
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return
+            method, target = request_line[0], urlsplit(request_line[1])
+
+            status, body = 200, None
+            if target.path == '/stats' and method == 'GET':
+                body = self.stats()
+            elif target.path == '/think' and method in ('GET', 'POST'):
+                if method == 'GET':
+                    params = {name: values[0] for name, values in parse_qs(target.query).items()}
+                    params['query'] = params.pop('q', '')
+                else:
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_REQUEST:
+                        raise TooLarge(f'request body longer than {MAX_REQUEST} bytes')
+                    params = json.loads(await reader.readexactly(length)) if length else {}
+                reply, latency = await self.think(str(params.get('query', '')), params.get('session'))
+                body = {'reply': reply, 'latency_ms': latency}
+            else:
+                status, body = 404, {'error': 'not found'}
+        except TooLarge as error:
+            status, body = 413, {'error': str(error)}
+        except Exception as error:
+            status, body = 400, {'error': f'{type(error).__name__}: {error}'}
+
+        try:
+            payload = json.dumps(body).encode()
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Content Too Large'}[status]
+            writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host : str = '127.0.0.1', port : int = 7007, unix : str = None, http_port : int = None):
+        servers = []
+        if unix:
+            servers.append(await asyncio.start_unix_server(self.handle_lines, unix, limit=MAX_REQUEST))
+        else:
+            servers.append(await asyncio.start_server(self.handle_lines, host, port, limit=MAX_REQUEST))
+        if http_port is not None:
+            servers.append(await asyncio.start_server(self.handle_http, host, http_port, limit=MAX_REQUEST))
+        for server in servers:
+            for sock in server.sockets:
+                print('listening on', sock.getsockname(), flush=True)
+        if self.watcher is not None:
+            self.watcher.start()
+        try:
+            await asyncio.gather(self._sweep(), *(server.serve_forever() for server in servers))
+        finally:
+            if self.watcher is not None:
+                self.watcher.stop()
+            self.executor.shutdown(wait=False)
+
+
+QUERIES = ['who is tiger?', 'who is carnivore?', 'what tiger is?', 'who study intelligent systems?',
+           'when inna study intelligent systems?', 'where inna study intelligent systems?',
+           'who study with inna?', 'which dog eat apples', 'my dog eat apples at night', 'is pig omnivore?']
+
+
+# load generator: connections each keep up to pipeline requests in flight
+async def load(host : str, port : int, unix : str, connections : int, requests : int, pipeline : int):
+    latencies = []
+    errors = 0
+
+    async def client(count : int):
+        nonlocal errors
+        if unix:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        sent = {}
+        window = asyncio.Semaphore(pipeline)
+
+        async def receive():
+            nonlocal errors
+            for _ in range(count):
+                response = json.loads(await reader.readline())
+                latencies.append((time.perf_counter() - sent.pop(response['id'])) * 1e3)
+                errors += 'error' in response
+                window.release()
+
+        receiver = asyncio.create_task(receive())
+        for i in range(count):
+            await window.acquire()
+            sent[i] = time.perf_counter()
+            writer.write((json.dumps({'id': i, 'query': QUERIES[i % len(QUERIES)]}) + '\n').encode())
+            await writer.drain()
+        await receiver
+        writer.close()
+
+    start = time.perf_counter()
+    share, extra = divmod(requests, connections)
+    await asyncio.gather(*(client(share + (i < extra)) for i in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    print(f'{len(latencies)} requests over {connections} connections in {elapsed:.2f}s: '
+          f'{len(latencies) / elapsed:.0f} req/s, {errors} errors')
+    stats = summary(latencies)
+    for name in ('p50', 'p95', 'p99', 'max', 'mean'):
+        if name in stats:
+            print(f'  {name:<4} {stats[name]:8.2f} ms')
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Lux network server')
+    commands = argparser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'load'):
+        command = commands.add_parser(name)
+        command.add_argument('--host', default='127.0.0.1')
+        command.add_argument('--port', type=int, default=7007)
+        command.add_argument('--unix', help='unix socket path instead of TCP')
+    serve, load_ = commands.choices['serve'], commands.choices['load']
+    serve.add_argument('--http-port', type=int, help='also serve HTTP on this port')
+    serve.add_argument('--max-in-flight', type=int, default=64)
+    serve.add_argument('--idle-timeout', type=float, default=1800.0, help='seconds before an idle session is dropped')
+    serve.add_argument('--max-session-facts', type=int, default=1000000, help='facts all sessions may hold together')
+    serve.add_argument('--data', default=DATAFILE)
+    serve.add_argument('--metrics', action='store_true', help='trace every query into /stats')
+    serve.add_argument('--watch', type=float, metavar='SECONDS', nargs='?', const=1.0,
+                       help='hot reload the data file, looking at it every SECONDS (1 by default)')
+    load_.add_argument('--connections', type=int, default=16)
+    load_.add_argument('--requests', type=int, default=2000)
+    load_.add_argument('--pipeline', type=int, default=4, help='requests in flight per connection')
+
+    args = argparser.parse_args()
+    try:
+        if args.command == 'serve':
+            lux = Lux(args.data, metrics=Metrics() if args.metrics else None)
+            sessions = SessionStore(lux, args.idle_timeout, args.max_session_facts)
+            watcher = DataWatcher(lux, args.watch) if args.watch is not None else None
+            server = LuxServer(lux, args.max_in_flight, sessions, watcher)
+            asyncio.run(server.serve(args.host, args.port, args.unix, args.http_port))
+        else:
+            asyncio.run(load(args.host, args.port, args.unix, args.connections, args.requests, args.pipeline))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+if __name__ == '__main__':
+    main()
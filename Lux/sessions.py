@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from Lux import Lux
+
+
+class SessionStore():
+
+    # Conversations with one Lux, each with its own knowledge base overlay:
+    # the facts a session states are visible to that session only, while the
+    # rules and facts of the Lux are shared by all of them. A session is
+    # dropped after idle_timeout seconds without a query; when all overlays
+    # together hold more than max_facts facts (or there are more than
+    # max_sessions), the least recently used sessions are dropped first.
+    def __init__(self, lux : Lux, idle_timeout : float = 1800.0, max_facts : int = 1000000,
+                 max_sessions : int = 100000, cache_size : int = 64):
+        self.lux = lux
+        self.idle_timeout = idle_timeout
+        self.max_facts = max_facts
+        self.max_sessions = max_sessions
+        self.cache_size = cache_size
+        self.evicted = 0
+        self._sessions = OrderedDict()  # session id -> (overlay, last used), oldest first
+        self._facts = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session : str):
+        return session in self._sessions
+
+    @property
+    def facts(self):
+        return self._facts
+
+    def get(self, session : str):
+        entry = self._sessions.pop(session, None)
+        overlay = entry[0] if entry is not None else self.lux.overlay(self.cache_size)
+        self._sessions[session] = (overlay, time.monotonic())
+        if entry is None:
+            self._enforce(session)
+        return overlay
+
+    def think(self, session : str, query : str):
+        overlay = self.get(session)
+        before = len(overlay)
+        reply = self.lux.think(query, overlay)
+        if len(overlay) != before:
+            self._facts += len(overlay) - before
+            self._enforce(session)
+        return reply
+
+    def drop(self, session : str):
+        entry = self._sessions.pop(session, None)
+        if entry is not None:
+            self._facts -= len(entry[0])
+        return entry is not None
+
+    # drops the sessions idle for longer than idle_timeout, returns how many
+    def evict_idle(self, now : float = None):
+        deadline = (time.monotonic() if now is None else now) - self.idle_timeout
+        count = 0
+        while self._sessions:
+            session, (_, used) = next(iter(self._sessions.items()))
+            if used > deadline:
+                break
+            self.drop(session)
+            count += 1
+        self.evicted += count
+        return count
+
+    # least recently used first, never the session that is being served
+    def _enforce(self, current : str):
+        while (self._facts > self.max_facts or len(self._sessions) > self.max_sessions) and len(self._sessions) > 1:
+            session = next(iter(self._sessions))
+            if session == current:
+                break
+            self.drop(session)
+            self.evicted += 1
+
+    def stats(self):
+        return {'sessions': len(self._sessions), 'facts': self._facts, 'evicted': self.evicted}
@@ -0,0 +1,28 @@
+import os
+import sys
+import shutil
+import pytest
+import yaml
+
+# the modules of Lux import each other by their plain names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATAFILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data.yaml')
+
+
+# a copy of data.yaml a test may edit
+@pytest.fixture
+def datafile(tmp_path):
+    path = str(tmp_path / 'data.yaml')
+    shutil.copy(DATAFILE, path)
+    return path
+
+
+# rewrites the data.yaml at path without the rules in remove and with those in add
+def edit(path : str, remove=(), add=(), synonyms=None):
+    with open(path) as file:
+        data = yaml.safe_load(file)
+    data['rules'] = [rule for rule in data['rules'] if rule not in remove] + list(add)
+    data['synonyms'].update(synonyms or {})
+    with open(path, 'w') as file:
+        yaml.safe_dump(data, file)
@@ -0,0 +1,15 @@
+import time
+from Lux import Lux, TOO_BROAD
+from conftest import DATAFILE
+
+
+def test_broad_question_over_a_large_relation_stops_in_time():
+    lux = Lux(DATAFILE)
+    lux.processor.add_facts(('has', (f'entity{i}', '_', f'value{i % 1000}', '_', '_')) for i in range(100000))
+    lux.processor.engine.timeout = 0.2
+    start = time.perf_counter()
+    reply = lux.think('who is?')
+    assert time.perf_counter() - start < 1.0
+    assert reply == TOO_BROAD
+    # nothing of it was cached: a narrow question still gets its answer
+    assert lux.think('who is tiger?') == 'Tiger has tiger.'
@@ -0,0 +1,40 @@
+import json
+import pytest
+from Lux import Lux
+from ingest import ingest
+from conftest import DATAFILE
+
+
+def write(path, text : str):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_statements_are_learned_as_think_learns_them(tmp_path):
+    path = write(tmp_path / 'facts.txt', 'Dog eat apples\ndog eat apples\nwho eat apples?\n\nInna study functional programming\n')
+    lux = Lux(DATAFILE)
+    report = ingest(lux, [path])
+    assert (report['read'], report['added'], report['duplicates'], report['skipped']) == (4, 2, 1, 1)
+    assert lux.think('who eat apples?') == 'Dog eat apples.'
+    assert 'inna' in lux.think('who study functional programming?').lower()
+
+
+@pytest.mark.parametrize('format', ['csv', 'jsonl'])
+def test_rows_are_read_as_think_reads_words(tmp_path, format):
+    rows = [['eat', 'Dog', '', 'Apples', '', ''],
+            ['study', 'Vasyl', '', 'Intelligent systems', '', ''],
+            ['is', 'Rex', '', 'the cat', '', ''],
+            ['eat', 'big dog', '', 'pears', '', '']]
+    if format == 'csv':
+        path = write(tmp_path / 'facts.csv', 'rule,subject,belong,value,addition_prefix,addition\n' +
+                     ''.join(','.join(row) + '\n' for row in rows))
+    else:
+        path = write(tmp_path / 'facts.jsonl', ''.join(json.dumps(row) + '\n' for row in rows))
+    lux = Lux(DATAFILE)
+    report = ingest(lux, [path])
+    # "big dog" is two words, no question could name it
+    assert (report['read'], report['added'], report['skipped']) == (4, 3, 1)
+    assert lux.think('who eat apples?') == 'Dog eat apples.'
+    assert 'vasyl' in lux.think('who study intelligent systems?').lower()
+    assert lux.think('who is cat?') == 'Rex has cat.'
+    assert 'dog' not in lux.think('who eat pears?').lower()
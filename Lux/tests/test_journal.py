@@ -0,0 +1,112 @@
+import os
+import time
+import pytest
+from Lux import Lux
+from journal import Journal, JOURNAL, ROTATED
+from knowledge import KnowledgeBase
+from conftest import DATAFILE
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    return str(tmp_path / 'state')
+
+
+def test_learned_facts_survive_a_restart(state_dir):
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    lux.think('dog eat apples')
+    lux.close()
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    lux.close()
+
+
+def test_records_reach_the_file_without_a_sync(state_dir):
+    crashed = Lux(DATAFILE, state_dir=state_dir)
+    crashed.think('dog eat apples')
+    crashed.think('cat eat fish at night')
+    assert os.path.getsize(os.path.join(state_dir, JOURNAL)) > 0
+    # the first Lux is never closed, as if its process had died
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    assert lux.think('when cat eat fish?') == 'Cat eat fish at night.'
+    lux.close()
+    crashed.close()
+
+
+def test_idle_journal_is_synced_by_the_timer(state_dir):
+    journal = Journal(state_dir, sync_every=1000, sync_interval=0.01)
+    journal.restore(KnowledgeBase(), [])
+    journal.append('eat', ('dog', '_', 'apples', '_', '_'))
+    deadline = time.monotonic() + 5
+    while journal._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert journal._pending == 0
+    journal.close()
+
+
+def test_torn_record_is_cut_off(state_dir):
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    lux.think('dog eat apples')
+    lux.close()
+    path = os.path.join(state_dir, JOURNAL)
+    size = os.path.getsize(path)
+    with open(path, 'ab') as file:
+        file.write(b'[2, "eat", ["cat", "_", "fi')
+
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert os.path.getsize(path) == size
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    lux.think('cat eat fish')
+    lux.close()
+
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    assert lux.think('what cat eat?') == 'Cat eat fish.'
+    lux.close()
+
+
+def test_records_after_a_snapshot_are_replayed(state_dir):
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    lux.think('dog eat apples')
+    lux.processor.journal.snapshot(wait=True)
+    lux.think('cat eat fish')
+    crashed = lux
+
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    assert lux.think('what cat eat?') == 'Cat eat fish.'
+    lux.close()
+    crashed.close()
+
+
+def test_records_of_an_unfinished_snapshot_are_replayed(state_dir):
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    lux.think('dog eat apples')
+    lux.think('cat eat fish')
+    lux.close()
+    # the journal was set aside for a snapshot that never reached the disk
+    os.replace(os.path.join(state_dir, JOURNAL), os.path.join(state_dir, ROTATED))
+
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert not os.path.exists(os.path.join(state_dir, ROTATED))
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    lux.think('bird eat seeds')
+    lux.close()
+
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert lux.think('what cat eat?') == 'Cat eat fish.'
+    assert lux.think('what bird eat?') == 'Bird eat seeds.'
+    assert lux.processor.journal.sequence == 3
+    lux.close()
+
+
+def test_snapshot_is_written_while_learning_goes_on(state_dir):
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    lux.processor.journal.snapshot_every = 2
+    for food in ('apples', 'pears', 'plums', 'figs', 'kiwis'):
+        lux.think(f'dog eat {food}')
+    lux.close()
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    assert lux.think('what dog eat?') == 'Dog eat apples, figs, kiwis, pears, plums.'
+    lux.close()
@@ -0,0 +1,42 @@
+import pytest
+from Lux import Lux
+from conftest import edit
+
+
+@pytest.mark.parametrize('materialized', [False, True])
+def test_sessions_do_not_see_each_other(datafile, materialized):
+    lux = Lux(datafile, materialized=materialized)
+    first, second = lux.overlay(), lux.overlay()
+    lux.think('rex eat meat', first)
+    assert 'rex' in lux.think('who is carnivore?', first).lower()
+    assert 'rex' not in lux.think('who is carnivore?', second).lower()
+    assert 'rex' not in lux.think('who is carnivore?').lower()
+
+
+@pytest.mark.parametrize('materialized', [False, True])
+def test_session_answers_follow_a_fact_the_base_learns(datafile, materialized):
+    lux = Lux(datafile, materialized=materialized)
+    session = lux.overlay()
+    lux.think('rex eat meat', session)
+    assert 'kitty' not in lux.think('who is carnivore?', session).lower()
+    lux.think('kitty eat meat')
+    answer = lux.think('who is carnivore?', session).lower()
+    assert 'kitty' in answer and 'rex' in answer
+
+
+@pytest.mark.parametrize('materialized', [False, True])
+def test_session_answers_follow_a_reload(datafile, materialized):
+    lux = Lux(datafile, materialized=materialized)
+    session = lux.overlay()
+    lux.think('rex eat meat', session)
+    lux.think('rex is small', session)
+    assert 'rex' not in lux.think('who is cat?', session).lower()
+    edit(datafile, add=['has(Entity,_,cat,_,_) :- has(Entity,_,carnivore,_,_), has(Entity,_,small,_,_)'])
+    lux.reload()
+    assert 'rex' in lux.think('who is cat?', session).lower()
+    assert 'rex' not in lux.think('who is cat?').lower()
+
+    edit(datafile, remove=['has(Entity,_,cat,_,_) :- has(Entity,_,carnivore,_,_), has(Entity,_,small,_,_)'])
+    lux.reload()
+    assert 'rex' not in lux.think('who is cat?', session).lower()
+    assert 'rex' in lux.think('who is carnivore?', session).lower()
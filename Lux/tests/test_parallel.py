@@ -0,0 +1,43 @@
+import os
+import json
+import multiprocessing as mp
+import pytest
+from Lux import Lux
+from journal import JOURNAL
+from parallel import LuxPool
+from conftest import DATAFILE, edit
+
+
+@pytest.mark.skipif('fork' not in mp.get_all_start_methods(), reason='LuxPool forks its workers')
+def test_workers_do_not_journal(tmp_path):
+    state_dir = str(tmp_path)
+    lux = Lux(DATAFILE, state_dir=state_dir)
+    queries = ['who is tiger?', 'dog eat apples', 'what dog eat?', 'cat eat fish', 'what cat eat?', 'who is lion?'] * 4
+    with LuxPool(lux, workers=2) as pool:
+        replies = list(pool.think_many(queries))
+    lux.close()
+    assert replies[2] == 'Dog eat apples.' and replies[4] == 'Cat eat fish.'
+    with open(os.path.join(state_dir, JOURNAL)) as file:
+        sequences = [json.loads(line)[0] for line in file]
+    assert sequences == [1, 2]
+
+
+@pytest.mark.skipif('fork' not in mp.get_all_start_methods(), reason='LuxPool forks its workers')
+def test_pool_applies_a_scheduled_reload(datafile):
+    lux = Lux(datafile)
+    with LuxPool(lux, workers=2) as pool:
+        assert list(pool.think_many(['who is lion?'])) == ['Lion has lion.']
+        edit(datafile, remove=['has(lion, _, mane, _, _)'])
+        lux.schedule_reload(lux.prepare_reload())
+        lion, tiger = pool.think_many(['who is lion?', 'who is tiger?'])
+        assert 'Lion' not in lion and tiger == 'Tiger has tiger.'
+    assert lux.pending is None
+
+
+def test_think_many_applies_a_reload_scheduled_mid_stream(datafile):
+    lux = Lux(datafile)
+    replies = lux.think_many(['who is lion?'] * 2)
+    assert next(replies) == 'Lion has lion.'
+    edit(datafile, remove=['has(lion, _, mane, _, _)'])
+    lux.schedule_reload(lux.prepare_reload())
+    assert 'Lion' not in next(replies)
@@ -0,0 +1,23 @@
+import random
+from knowledge import Relation, SCAN_LIMIT
+
+
+def test_relation_past_scan_limit_agrees_with_a_set():
+    rng = random.Random(7)
+    relation, model = Relation(3), set()
+    values = [f'v{i}' for i in range(12)]
+    for step in range(20000):
+        row = (rng.choice(values), rng.choice(values), rng.choice(values))
+        if rng.random() < 0.7:
+            assert relation.add(row) == (row not in model)
+            model.add(row)
+        else:
+            assert relation.remove(row) == (row in model)
+            model.discard(row)
+        if step % 997 == 0:
+            assert set(relation) == model and len(relation) == len(model)
+            assert all(row in relation for row in model)
+    assert relation.slots is not None and len(model) > SCAN_LIMIT
+    assert set(relation) == model
+    for row in model:
+        assert set(relation.match((None, row[1], row[2]))) == {other for other in model if other[1:] == row[1:]}
@@ -0,0 +1,78 @@
+import pytest
+from Lux import Lux
+from conftest import edit
+
+QUESTIONS = ['who is lion?', 'who is tiger?', 'who is cat?', 'who is carnivore?', 'who is omnivore?',
+             'what tiger is?', 'what rex is?', 'who study with inna?', 'who is kitty?']
+
+
+@pytest.mark.parametrize('materialized', [False, True])
+def test_reload_matches_a_fresh_start(datafile, materialized):
+    lux = Lux(datafile, materialized=materialized)
+    lux.think('rex eat meat')
+    edit(datafile,
+         remove=['has(lion, _, mane, _, _)',
+                 'has(Entity,_,tiger,_,_) :- has(Entity,_,carnivore,_,_), has(Entity,_,yellow,_,_), has(Entity,_,stripes,_,_)'],
+         add=['has(Entity,_,cat,_,_) :- has(Entity,_,carnivore,_,_), has(Entity,_,small,_,_)',
+              'has(rex, _, small, _, _)'],
+         synonyms={'kitty': 'cat'})
+    assert lux.reload() is not None
+
+    fresh = Lux(datafile, materialized=materialized)
+    fresh.think('rex eat meat')
+    for question in QUESTIONS:
+        assert lux.think(question) == fresh.think(question), question
+
+
+YELLOW = 'has(tiger, _, yellow, _, _)'
+
+
+def test_reload_keeps_a_learned_fact_data_yaml_dropped(datafile, tmp_path):
+    state_dir = str(tmp_path / 'state')
+    lux = Lux(datafile, state_dir=state_dir)
+    lux.think('tiger is yellow')
+    edit(datafile, remove=[YELLOW])
+    lux.reload()
+    assert 'yellow' in lux.think('what tiger is?')
+    lux.close()
+
+    lux = Lux(datafile, state_dir=state_dir)
+    assert 'yellow' in lux.think('what tiger is?')
+    lux.processor.journal.snapshot(wait=True)
+    lux.close()
+    lux = Lux(datafile, state_dir=state_dir)
+    assert 'yellow' in lux.think('what tiger is?')
+    lux.close()
+
+
+def test_reload_drops_a_data_fact_nobody_taught(datafile):
+    lux = Lux(datafile)
+    edit(datafile, remove=[YELLOW])
+    lux.reload()
+    assert 'yellow' not in lux.think('what tiger is?')
+
+
+def test_learned_fact_data_yaml_adds_and_drops_again_is_kept(datafile, tmp_path):
+    state_dir = str(tmp_path / 'state')
+    lux = Lux(datafile, state_dir=state_dir)
+    lux.think('dog eat apples')
+    edit(datafile, add=['eat(dog, _, apples, _, _)'])
+    lux.reload()
+    lux.processor.journal.snapshot(wait=True)
+    lux.close()
+
+    lux = Lux(datafile, state_dir=state_dir)
+    edit(datafile, remove=['eat(dog, _, apples, _, _)'])
+    lux.reload()
+    assert lux.think('what dog eat?') == 'Dog eat apples.'
+    lux.close()
+
+
+def test_reload_keeps_a_session_statement_data_yaml_dropped(datafile):
+    lux = Lux(datafile)
+    session = lux.overlay()
+    lux.think('tiger is yellow', session)
+    edit(datafile, remove=[YELLOW])
+    lux.reload()
+    assert 'yellow' in lux.think('what tiger is?', session)
+    assert 'yellow' not in lux.think('what tiger is?')
@@ -0,0 +1,41 @@
+import json
+import asyncio
+from Lux import Lux
+from server import LuxServer, MAX_REQUEST
+from conftest import DATAFILE
+
+
+def serve(handler, client):
+    async def run():
+        server = await asyncio.start_server(handler, '127.0.0.1', 0, limit=MAX_REQUEST)
+        try:
+            connection = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            return await asyncio.wait_for(client(*connection), 5)
+        finally:
+            server.close()
+    return asyncio.run(run())
+
+
+def test_an_overlong_line_gets_an_error_and_the_connection_goes_on():
+    async def client(reader, writer):
+        writer.write(b'{"id": 1, "query": "' + b'a' * (2 * MAX_REQUEST) + b'"}\n')
+        writer.write(b'{"id": 2, "query": "who is tiger?"}\n')
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(2)]
+        writer.close()
+        return responses
+
+    error, answer = serve(LuxServer(Lux(DATAFILE)).handle_lines, client)
+    assert 'longer than' in error['error']
+    assert answer == {'id': 2, 'reply': 'Tiger has tiger.', 'latency_ms': answer['latency_ms']}
+
+
+def test_an_http_body_past_the_limit_is_refused():
+    async def client(reader, writer):
+        writer.write(f'POST /think HTTP/1.1\r\nContent-Length: {MAX_REQUEST + 1}\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    assert serve(LuxServer(Lux(DATAFILE)).handle_http, client).startswith(b'HTTP/1.1 413 ')
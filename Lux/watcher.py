@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+from Lux import Lux
+
+# seconds between looks at data.yaml
+INTERVAL = 1.0
+
+
+class DataWatcher():
+
+    # Polls the data.yaml of a Lux and hot reloads it when it changes (see
+    # Lux.prepare_reload). A change is only read once the file looked the same
+    # on two polls in a row, so a file that is still being written is not
+    # loaded half way. The file is read and diffed on the watcher thread; the
+    # next think applies the change. A file that does not load (a YAML error,
+    # say) is reported and the data in use stays as it is.
+    def __init__(self, lux : Lux, interval : float = INTERVAL):
+        self.lux = lux
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self.last_error = None
+        self._seen = self._loaded = self._stamp()
+        self._thread = None
+        self._stopping = None
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.lux.datafile)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    # one poll, returns the change it scheduled (or None)
+    def check(self):
+        stamp = self._stamp()
+        if stamp != self._seen:
+            self._seen = stamp
+            return None
+        if stamp is None or stamp == self._loaded:
+            return None
+        self._loaded = stamp
+        try:
+            change = self.lux.prepare_reload()
+        except Exception as error:
+            self.errors += 1
+            self.last_error = f'{type(error).__name__}: {error}'
+            print(f'{self.lux.datafile} not reloaded: {self.last_error}', file=sys.stderr, flush=True)
+            return None
+        if change is not None:
+            self.lux.schedule_reload(change)
+            self.reloads += 1
+        return change
+
+    def start(self):
+        self.stop()
+        stopping = threading.Event()
+
+        def poll():
+            while not stopping.wait(self.interval):
+                self.check()
+
+        self._stopping = stopping
+        self._thread = threading.Thread(target=poll, name='lux-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = self._stopping = None
+
+    def stats(self):
+        return {'reloads': self.reloads, 'errors': self.errors, 'last_error': self.last_error}